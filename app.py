@@ -1,72 +1,146 @@
-# app.py
-import os
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
-from routers import cars, reservations, rentals, invoices, payments, auth, dashboard
-
-app = FastAPI(title="GearUp API")
-
-# CORS
-ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=ALLOWED_ORIGINS,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Health check
-@app.get("/health")
-def health_check():
-    return {"status": "ok", "message": "API is running"}
-
-# API Routers
-app.include_router(auth.router)
-app.include_router(cars.router)
-app.include_router(reservations.router)
-app.include_router(rentals.router)
-app.include_router(invoices.router)
-app.include_router(payments.router)
-app.include_router(dashboard.router)
-
-# Serve static files (CSS, JS)
-@app.get("/config.js")
-def serve_config():
-    return FileResponse("config.js")
-
-@app.get("/styles.css")
-def serve_styles():
-    return FileResponse("styles.css")
-
-@app.get("/staff.css")
-def serve_staff_css():
-    return FileResponse("staff.css")
-
-# Serve HTML pages
-@app.get("/")
-def serve_index():
-    return FileResponse("index.html")
-
-@app.get("/login.html")
-def serve_login():
-    return FileResponse("login.html")
-
-@app.get("/signup.html")
-def serve_signup():
-    return FileResponse("signup.html")
-
-@app.get("/reset.html")
-def serve_reset():
-    return FileResponse("reset.html")
-
-@app.get("/staff-login.html")
-def serve_staff_login():
-    return FileResponse("staff-login.html")
-
-@app.get("/staff.html")
-def serve_staff():
-    return FileResponse("staff.html")
\ No newline at end of file
+# app.py
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+import db
+import migrations
+import hashing
+import catalog
+import idempotency
+import static_assets
+import metrics
+import jobs
+import events
+from routers import cars, reservations, rentals, invoices, payments, auth, dashboard
+
+# apply pending schema migrations on startup (otherwise run: python -m migrations)
+AUTO_MIGRATE = os.getenv("AUTO_MIGRATE", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if AUTO_MIGRATE:
+        await asyncio.to_thread(migrations.migrate)
+    # double-booking protection, revenue_daily and amount_paid live in
+    # migrations; serving without them would be silently wrong
+    missing = await asyncio.to_thread(migrations.pending)
+    if missing:
+        names = ", ".join(f"{v:04d}_{n}" for v, n in missing)
+        raise RuntimeError(f"Pending migrations: {names}. Run: python -m migrations (or set AUTO_MIGRATE=1)")
+    static_assets.load()
+    await db.open_pool()
+    try:
+        await catalog.get_cars()  # warm the fleet cache before the first GET /cars
+    except Exception:  # not fatal: the first GET /cars loads it instead
+        logger.warning("catalog warm-up failed", exc_info=True)
+    hashing.start()
+    idempotency.start_sweeper()
+    jobs.start()
+    events.start()
+    try:
+        yield
+    finally:
+        await events.stop()
+        await jobs.stop()
+        await idempotency.stop_sweeper()
+        hashing.shutdown()
+        await db.close_pool()
+
+app = FastAPI(title="GearUp API", lifespan=lifespan)
+
+# CORS
+ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "*").split(",")
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=ALLOWED_ORIGINS,
+    allow_credentials=True,
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+# outermost, so it times everything including CORS handling;
+# the SSE stream is long-lived and would skew the latency histogram
+app.add_middleware(metrics.MetricsMiddleware, skip_paths=("/metrics", "/dashboard/stream"))
+
+# Liveness only; /health/db checks the database
+@app.get("/health")
+def health_check():
+    return {"status": "ok", "message": "API is running"}
+
+@app.get("/health/db")
+async def db_health():
+    """Pool stats plus a live round trip; 503 when the database can't be reached."""
+    stats = db.pool.get_stats()
+    body = {
+        "status": "ok",
+        "pool": {
+            "min": stats.get("pool_min"),
+            "max": stats.get("pool_max"),
+            "size": stats.get("pool_size"),
+            "available": stats.get("pool_available"),
+            "waiting": stats.get("requests_waiting"),
+            "requests": stats.get("requests_num", 0),
+            "requests_wait_ms": stats.get("requests_wait_ms", 0),
+            "requests_errors": stats.get("requests_errors", 0),
+            "connections_errors": stats.get("connections_errors", 0),
+        },
+        "statement_timeout_ms": db.DB_STATEMENT_TIMEOUT_MS or None,
+        "prepare_threshold": db.DB_PREPARE_THRESHOLD,
+    }
+    t0 = time.perf_counter()
+    try:
+        async with db.pool.connection(timeout=2) as conn:
+            await conn.execute("SELECT 1")
+        body["ping_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    except Exception as e:
+        body.update(status="error", error=repr(e))
+        return JSONResponse(status_code=503, content=body)
+    return body
+
+@app.get("/health/hashing")
+async def hashing_stats():
+    return hashing.stats()
+
+@app.get("/health/catalog")
+async def catalog_stats():
+    return catalog.stats()
+
+@app.get("/health/jobs")
+async def jobs_stats():
+    return jobs.stats()
+
+@app.get("/health/events")
+async def events_stats():
+    return events.stats()
+
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    h = hashing.stats()
+    return metrics.render(
+        pool_stats=db.pool.get_stats(),
+        extra={
+            "hash_queue_depth": ("Password hashes waiting for a worker.", h["queue_depth"]),
+            "hash_in_flight": ("Password hashes running or queued.", h["in_flight"]),
+            "hash_rejected_total": ("Hash requests rejected with 503.", h["rejected"]),
+        },
+    )
+
+# API Routers
+app.include_router(auth.router)
+app.include_router(cars.router)
+app.include_router(reservations.router)
+app.include_router(rentals.router)
+app.include_router(invoices.router)
+app.include_router(payments.router)
+app.include_router(dashboard.router)
+app.include_router(dashboard.stream_router)
+
+# Static pages and assets (HTML, CSS, JS), served from memory
+static_assets.register(app)
@@ -0,0 +1,86 @@
+-- Base schema for the benchmark database.
+--
+-- The production schema predates migrations/ and is not in the repo; this
+-- reconstructs it from the columns, enums and id formats the routers use
+-- (CAR-#, RES-#, INV-#, EMP-#) so the app runs unchanged against it.
+-- migrations/*.sql are applied on top by bench/run.py.
+
+CREATE TYPE car_category       AS ENUM ('small', 'large');
+CREATE TYPE transmission_type  AS ENUM ('auto', 'manual');
+CREATE TYPE car_status         AS ENUM ('Available', 'Reserved', 'Rented', 'Maintenance');
+CREATE TYPE reservation_status AS ENUM ('Reserved', 'Active', 'Completed', 'Cancelled');
+CREATE TYPE payment_status     AS ENUM ('unpaid', 'partial', 'paid');
+
+CREATE SEQUENCE cars_seq;
+CREATE SEQUENCE employees_seq;
+CREATE SEQUENCE reservations_seq;
+CREATE SEQUENCE invoices_seq;
+CREATE SEQUENCE payments_seq;
+
+CREATE TABLE public.cars (
+  car_id        text PRIMARY KEY DEFAULT 'CAR-' || nextval('cars_seq'),
+  plate_no      text NOT NULL UNIQUE,
+  brand         text NOT NULL,
+  model         text NOT NULL,
+  year          integer NOT NULL,
+  category      car_category NOT NULL,
+  fuel_type     text,
+  color         text,
+  seats         integer,
+  transmission  transmission_type NOT NULL,
+  price_per_day numeric(10,2) NOT NULL,
+  status        car_status NOT NULL DEFAULT 'Available',
+  photo_url     text,
+  created_at    timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE public.customers (
+  license_no     text PRIMARY KEY,
+  first_name     text NOT NULL,
+  last_name      text NOT NULL,
+  email          text NOT NULL UNIQUE,
+  phone          text,
+  license_expiry date,
+  date_of_birth  date,
+  address_street text,
+  address_city   text,
+  password_hash  text
+);
+
+CREATE TABLE public.employees (
+  emp_id        text PRIMARY KEY DEFAULT 'EMP-' || nextval('employees_seq'),
+  email         text NOT NULL UNIQUE,
+  role          text NOT NULL,
+  password_hash text,
+  first_name    text,
+  last_name     text
+);
+
+CREATE TABLE public.reservations (
+  res_id              text PRIMARY KEY DEFAULT 'RES-' || nextval('reservations_seq'),
+  customer_license_no text NOT NULL REFERENCES public.customers (license_no),
+  car_id              text NOT NULL REFERENCES public.cars (car_id),
+  start_date          date NOT NULL,
+  end_date            date NOT NULL,
+  status              reservation_status NOT NULL DEFAULT 'Reserved',
+  created_at          timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE public.invoices (
+  inv_id         text PRIMARY KEY DEFAULT 'INV-' || nextval('invoices_seq'),
+  reservation_id text NOT NULL UNIQUE REFERENCES public.reservations (res_id),
+  issue_date     date NOT NULL DEFAULT CURRENT_DATE,
+  total_amount   numeric(12,2) NOT NULL DEFAULT 0,
+  payment_status payment_status NOT NULL DEFAULT 'unpaid',
+  created_at     timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE TABLE public.payments (
+  pay_id     text PRIMARY KEY DEFAULT 'PAY-' || nextval('payments_seq'),
+  invoice_id text NOT NULL REFERENCES public.invoices (inv_id),
+  method     text NOT NULL,
+  amount     numeric(12,2) NOT NULL,
+  reference  text,
+  paid_at    timestamptz NOT NULL DEFAULT now()
+);
+CREATE INDEX payments_invoice_idx ON public.payments (invoice_id);
@@ -0,0 +1,152 @@
+# bench/seed.py
+"""
+Synthetic dataset for the benchmark database.
+
+Creates the base schema (bench/schema.sql) and fills it with a fleet,
+customers, two staff accounts and a reservation history, all generated
+server-side with generate_series so 1M reservations load in seconds.
+Run migrations afterwards so their backfills (revenue_daily, amount_paid)
+see the data, exactly as they would on the production database.
+
+Shape of the data:
+- reservation g belongs to car (g % cars) and slot (g / cars); slots are
+  4 days apart and a rental lasts 1-3 days, so no two reservations of a car
+  overlap and the reservations_no_overlap constraint validates
+- slots in the past are Completed with a (mostly) paid invoice and one
+  payment; the last ~FUTURE_SLOTS slots per car are upcoming Reserved
+  bookings the load test can start and close
+
+Usage:
+    python -m bench.seed --cars 1000 --customers 50000 --reservations 1000000
+"""
+import argparse
+import os
+import time
+from pathlib import Path
+import psycopg
+from passlib.hash import bcrypt, bcrypt_sha256
+
+SCHEMA_SQL = Path(__file__).with_name("schema.sql")
+
+# every bench account shares this password
+BENCH_PASSWORD = "bench-password"
+ADMIN_EMAIL = "admin@example.com"
+EMPLOYEE_EMAIL = "employee@example.com"
+SLOT_DAYS = 4
+FUTURE_SLOTS = 3
+
+BRANDS = ["Toyota", "Honda", "Kia", "Hyundai", "Nissan", "Mazda", "Ford", "BMW"]
+MODELS = ["Corolla", "Civic", "Rio", "Elantra", "Sunny", "CX-5", "Focus", "X3"]
+COLORS = ["White", "Black", "Silver", "Blue", "Red", "Grey"]
+FUELS = ["petrol", "diesel", "hybrid", "electric"]
+METHODS = ["cash", "card", "transfer"]
+
+def password_hash() -> str:
+    """Hash BENCH_PASSWORD under the app's policy so logins don't trigger a rehash."""
+    scheme = {"bcrypt": bcrypt, "bcrypt_sha256": bcrypt_sha256}[os.getenv("HASH_SCHEME", "bcrypt_sha256")]
+    return scheme.using(rounds=int(os.getenv("HASH_ROUNDS", "12"))).hash(BENCH_PASSWORD)
+
+def reset_schema(conn):
+    conn.execute("DROP SCHEMA IF EXISTS public CASCADE")
+    conn.execute("CREATE SCHEMA public")
+    conn.execute(SCHEMA_SQL.read_text())
+
+def seed(conn, cars: int, customers: int, reservations: int, verbose: bool = True):
+    pwd = password_hash()
+    slots = max(1, -(-reservations // cars))  # ceil
+    # anchor slot 0 so the last FUTURE_SLOTS slots of every car start after today
+    offset_days = (slots - FUTURE_SLOTS) * SLOT_DAYS
+    params = {
+        "cars": cars, "customers": customers, "reservations": reservations,
+        "offset": offset_days, "slot": SLOT_DAYS, "pwd": pwd,
+        "admin": ADMIN_EMAIL, "employee": EMPLOYEE_EMAIL,
+        "brands": BRANDS, "models": MODELS, "colors": COLORS, "fuels": FUELS, "methods": METHODS,
+    }
+
+    steps = [
+        ("cars", """
+            INSERT INTO public.cars (car_id, plate_no, brand, model, year, category, fuel_type,
+                                     color, seats, transmission, price_per_day, status, created_at)
+            SELECT 'CAR-' || g, 'BN-' || lpad(g::text, 6, '0'),
+                   (%(brands)s::text[])[1 + g %% 8], (%(models)s::text[])[1 + g %% 8],
+                   2015 + g %% 10,
+                   (CASE WHEN g %% 3 = 0 THEN 'large' ELSE 'small' END)::car_category,
+                   (%(fuels)s::text[])[1 + g %% 4], (%(colors)s::text[])[1 + g %% 6],
+                   CASE WHEN g %% 3 = 0 THEN 7 ELSE 4 + g %% 2 END,
+                   (CASE WHEN g %% 4 = 0 THEN 'manual' ELSE 'auto' END)::transmission_type,
+                   30 + (g %% 20) * 5, 'Available', now() - g * interval '1 minute'
+            FROM generate_series(1, %(cars)s) g
+        """),
+        ("customers", """
+            INSERT INTO public.customers (license_no, first_name, last_name, email, phone,
+                                          license_expiry, date_of_birth, password_hash)
+            SELECT 'LIC-' || g, 'First' || g, 'Last' || g, 'customer' || g || '@example.com',
+                   '+67300' || g, CURRENT_DATE + 365, DATE '1990-01-01' + g %% 7000, %(pwd)s
+            FROM generate_series(1, %(customers)s) g
+        """),
+        ("employees", """
+            INSERT INTO public.employees (emp_id, email, role, password_hash, first_name, last_name)
+            VALUES ('EMP-1', %(admin)s, 'admin', %(pwd)s, 'Bench', 'Admin'),
+                   ('EMP-2', %(employee)s, 'employee', %(pwd)s, 'Bench', 'Employee')
+        """),
+        ("reservations", """
+            INSERT INTO public.reservations (res_id, customer_license_no, car_id, start_date,
+                                             end_date, status, created_at)
+            SELECT 'RES-' || g, 'LIC-' || (1 + g %% %(customers)s), 'CAR-' || (1 + g %% %(cars)s),
+                   s.start_date, s.start_date + 1 + g %% 3,
+                   (CASE WHEN s.start_date > CURRENT_DATE THEN 'Reserved' ELSE 'Completed' END)::reservation_status,
+                   s.start_date - 7
+            FROM generate_series(1, %(reservations)s) g,
+                 LATERAL (SELECT CURRENT_DATE - %(offset)s::int + (g / %(cars)s::int) * %(slot)s::int AS start_date) s
+        """),
+        ("invoices", """
+            INSERT INTO public.invoices (inv_id, reservation_id, issue_date, total_amount,
+                                         payment_status, created_at)
+            SELECT 'INV-' || substr(r.res_id, 5), r.res_id, r.start_date,
+                   (r.end_date - r.start_date) * c.price_per_day,
+                   (CASE WHEN r.status = 'Completed' AND hashtext(r.res_id) %% 10 <> 0
+                         THEN 'paid' ELSE 'unpaid' END)::payment_status,
+                   r.created_at
+            FROM public.reservations r
+            JOIN public.cars c ON c.car_id = r.car_id
+        """),
+        ("payments", """
+            INSERT INTO public.payments (pay_id, invoice_id, method, amount, reference, paid_at)
+            SELECT 'PAY-' || substr(i.inv_id, 5), i.inv_id,
+                   (%(methods)s::text[])[1 + abs(hashtext(i.inv_id)) %% 3],
+                   i.total_amount, NULL, i.issue_date + interval '12 hours'
+            FROM public.invoices i
+            WHERE i.payment_status = 'paid'
+        """),
+        ("sequences", """
+            SELECT setval('cars_seq', %(cars)s), setval('employees_seq', 2),
+                   setval('reservations_seq', %(reservations)s), setval('invoices_seq', %(reservations)s),
+                   setval('payments_seq', %(reservations)s)
+        """),
+    ]
+    for name, sql in steps:
+        t0 = time.perf_counter()
+        with conn.transaction():
+            conn.execute(sql, params)
+        if verbose:
+            print(f"seeded {name} in {time.perf_counter() - t0:.1f}s")
+    conn.execute("ANALYZE")
+
+def main():
+    ap = argparse.ArgumentParser(description="Create and fill the benchmark database.")
+    ap.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL"))
+    ap.add_argument("--cars", type=int, default=1000)
+    ap.add_argument("--customers", type=int, default=50_000)
+    ap.add_argument("--reservations", type=int, default=1_000_000)
+    args = ap.parse_args()
+    if not args.database_url:
+        raise SystemExit("Pass --database-url or set BENCH_DATABASE_URL")
+
+    import migrations
+    with psycopg.connect(args.database_url, autocommit=True) as conn:
+        reset_schema(conn)
+        seed(conn, args.cars, args.customers, args.reservations)
+    migrations.migrate(args.database_url)
+
+if __name__ == "__main__":
+    main()
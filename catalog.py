@@ -0,0 +1,158 @@
+# catalog.py
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+import orjson
+from fastapi.encoders import jsonable_encoder
+from db import get_conn
+
+# In-process copy of public.cars for GET /cars.
+# Writes in this worker invalidate/patch it right away; the TTL bounds how
+# stale another worker's copy can get.
+CATALOG_TTL_SEC = float(os.getenv("CATALOG_TTL_SEC", "30"))
+# max number of distinct filter combinations kept pre-encoded
+ENCODED_CACHE_MAX = 256
+
+FLEET_SQL = """
+  SELECT
+    car_id               AS id,
+    plate_no,
+    brand, model, year,
+    category::text       AS category,
+    fuel_type,
+    color,
+    seats,
+    transmission::text   AS transmission,
+    price_per_day::float AS price_per_day,
+    status::text         AS status,
+    COALESCE(photo_url,'') AS photo_url,
+    created_at
+  FROM public.cars
+  ORDER BY price_per_day, brand, model
+"""
+
+_cars: Optional[list] = None
+_loaded_at = 0.0
+_generation = 0  # bumped on every invalidate() so an in-flight load can't resurrect old data
+_version = ""    # content digest of the fleet; identical across workers holding the same data
+_encoded: dict = {}  # filter tuple -> (etag, body bytes), valid for _version only
+_lock = asyncio.Lock()
+_stats = {"hits": 0, "misses": 0, "loads": 0, "invalidations": 0, "patches": 0}
+
+def _fresh() -> bool:
+    return _cars is not None and (time.monotonic() - _loaded_at) < CATALOG_TTL_SEC
+
+def _reversion():
+    global _version
+    _version = hashlib.blake2b(orjson.dumps(_cars), digest_size=8).hexdigest()
+    _encoded.clear()
+
+async def _load():
+    global _cars, _loaded_at
+    gen = _generation
+    async with get_conn() as conn:
+        cur = await conn.execute(FLEET_SQL)
+        rows = await cur.fetchall()
+    _stats["loads"] += 1
+    cars = jsonable_encoder(rows)
+    if gen == _generation:
+        _cars, _loaded_at = cars, time.monotonic()
+        _reversion()
+    return cars
+
+async def get_cars() -> list:
+    """Whole fleet as JSON-ready dicts, ordered like GET /cars."""
+    if _fresh():
+        _stats["hits"] += 1
+        return _cars
+    _stats["misses"] += 1
+    async with _lock:
+        # another request may have reloaded while we waited
+        if _fresh():
+            return _cars
+        return await _load()
+
+def filter_cars(cars: list,
+                category: Optional[str] = None,
+                seats: Optional[int] = None,
+                transmission: Optional[str] = None,
+                min_price: Optional[float] = None,
+                max_price: Optional[float] = None) -> list:
+    """Same semantics as the WHERE clauses list_cars used to build."""
+    out = []
+    for c in cars:
+        if category and c["category"] != category:
+            continue
+        if seats and (c["seats"] is None or c["seats"] < seats):
+            continue
+        if transmission and c["transmission"] != transmission:
+            continue
+        price = c["price_per_day"]
+        if min_price is not None and (price is None or price < min_price):
+            continue
+        if max_price is not None and (price is None or price > max_price):
+            continue
+        out.append(c)
+    return out
+
+async def get_encoded(category: Optional[str] = None,
+                      seats: Optional[int] = None,
+                      transmission: Optional[str] = None,
+                      min_price: Optional[float] = None,
+                      max_price: Optional[float] = None) -> tuple:
+    """(etag, json bytes) for one filter combination, encoded once per fleet version.
+    etag is None when the fleet changed mid-request."""
+    cars = await get_cars()
+    key = (category, seats, transmission, min_price, max_price)
+    hit = _encoded.get(key)
+    if hit is not None:
+        return hit
+
+    body = orjson.dumps(filter_cars(cars, *key))
+    if cars is not _cars:
+        # fleet changed (or load was superseded) while we awaited; don't cache or tag
+        return None, body
+    if len(_encoded) >= ENCODED_CACHE_MAX:
+        _encoded.clear()
+    _encoded[key] = (_etag(key), body)
+    return _encoded[key]
+
+def _etag(key: tuple) -> str:
+    k = hashlib.blake2b(repr(key).encode(), digest_size=4).hexdigest()
+    return f'"{_version}-{k}"'
+
+def fleet_version() -> str:
+    return _version
+
+def invalidate():
+    global _cars, _generation
+    _generation += 1
+    _cars = None
+    _encoded.clear()
+    _stats["invalidations"] += 1
+
+def set_status(car_id: str, status: str):
+    """Patch one car's status in place (rental start/close); ordering is unaffected."""
+    global _generation
+    if _cars is None:
+        return
+    for c in _cars:
+        if c["id"] == car_id:
+            c["status"] = status
+            _generation += 1
+            _reversion()
+            _stats["patches"] += 1
+            return
+    invalidate()
+
+def stats() -> dict:
+    return {
+        **_stats,
+        "cars": len(_cars) if _cars is not None else None,
+        "age_sec": round(time.monotonic() - _loaded_at, 1) if _cars is not None else None,
+        "ttl_sec": CATALOG_TTL_SEC,
+        "version": _version,
+        "encoded_variants": len(_encoded),
+    }
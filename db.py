@@ -1,8 +1,14 @@
 # db.py
 import os
+import time
+from contextlib import asynccontextmanager
+from typing import Optional
 from dotenv import load_dotenv
+from fastapi import HTTPException
+from psycopg import AsyncCursor
 from psycopg.rows import dict_row
-from psycopg_pool import ConnectionPool
+from psycopg_pool import AsyncConnectionPool, PoolTimeout, TooManyRequests
+import metrics
 
 load_dotenv()
 
@@ -11,19 +17,93 @@ DB_URL = os.getenv("DATABASE_URL")
 if not DB_URL:
     raise RuntimeError("DATABASE_URL not set. Add it in Railway environment variables.")
 
-# Connection pool settings (optimized for Railway)
-pool = ConnectionPool(
+class CountingCursor(AsyncCursor):
+    """Counts statements for /metrics (conn.execute goes through here too)."""
+    async def execute(self, *args, **kwargs):
+        metrics.count_query()
+        return await super().execute(*args, **kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        metrics.count_query()
+        return await super().executemany(*args, **kwargs)
+
+def _int_env(name: str, default: Optional[int]) -> Optional[int]:
+    """Integer env var; "" or "off" means None (feature disabled)."""
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    return None if raw.strip().lower() in ("", "off", "none") else int(raw)
+
+# Connection pool settings (defaults sized for a small Railway Postgres)
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "2"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "10"))
+DB_POOL_MAX_IDLE = float(os.getenv("DB_POOL_MAX_IDLE", "60"))
+DB_POOL_MAX_LIFETIME = float(os.getenv("DB_POOL_MAX_LIFETIME", "3600"))
+# seconds a request may wait for a connection, and how many may wait at
+# once (0 = unbounded) before getting a 503 instead of piling up
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_MAX_WAITING = int(os.getenv("DB_POOL_MAX_WAITING", "0"))
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", "10"))
+# server-side cap per statement; 0 = none
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# psycopg prepares a query after it ran this many times on a connection;
+# "off" behind a transaction-mode pgbouncer
+DB_PREPARE_THRESHOLD = _int_env("DB_PREPARE_THRESHOLD", 5)
+DB_PREPARED_MAX = int(os.getenv("DB_PREPARED_MAX", "100"))
+
+def _connect_kwargs() -> dict:
+    kwargs = {
+        "row_factory": dict_row,
+        "cursor_factory": CountingCursor,
+        "prepare_threshold": DB_PREPARE_THRESHOLD,
+        "connect_timeout": DB_CONNECT_TIMEOUT,
+    }
+    if DB_STATEMENT_TIMEOUT_MS:
+        kwargs["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}"
+    return kwargs
+
+async def _configure(conn):
+    conn.prepared_max = DB_PREPARED_MAX
+
+# open=False: the pool is opened/closed by the FastAPI lifespan in app.py
+pool = AsyncConnectionPool(
     conninfo=DB_URL,
-    min_size=1,
-    max_size=10,  # Increased for production traffic
-    max_idle=60,  # Longer idle time for Railway
-    kwargs={"row_factory": dict_row}
+    min_size=DB_POOL_MIN,
+    max_size=DB_POOL_MAX,
+    max_idle=DB_POOL_MAX_IDLE,
+    max_lifetime=DB_POOL_MAX_LIFETIME,
+    timeout=DB_POOL_TIMEOUT,
+    max_waiting=DB_POOL_MAX_WAITING,
+    kwargs=_connect_kwargs(),
+    configure=_configure,
+    open=False,
 )
 
-def get_conn():
+async def open_pool():
+    # wait for min_size connections so the first requests don't pay for connecting
+    await pool.open(wait=True, timeout=max(DB_POOL_TIMEOUT, DB_CONNECT_TIMEOUT))
+
+async def close_pool():
+    await pool.close()
+
+@asynccontextmanager
+async def get_conn():
     """
     Usage:
-        with get_conn() as conn:
-            rows = conn.execute("SELECT * FROM cars").fetchall()
+        async with get_conn() as conn:
+            cur = await conn.execute("SELECT * FROM cars")
+            rows = await cur.fetchall()
     """
-    return pool.connection()
\ No newline at end of file
+    t0 = time.perf_counter()
+    try:
+        async with pool.connection() as conn:
+            t1 = time.perf_counter()
+            metrics.observe_pool_wait(t1 - t0)
+            try:
+                yield conn
+            finally:
+                metrics.observe_checkout(time.perf_counter() - t1)
+    except (PoolTimeout, TooManyRequests):
+        # DB_POOL_TIMEOUT / DB_POOL_MAX_WAITING exceeded: shed load instead of queueing
+        raise HTTPException(status_code=503, detail="Database busy, please retry",
+                            headers={"Retry-After": "1"})
@@ -0,0 +1,149 @@
+# events.py
+"""
+Change feed over Postgres LISTEN/NOTIFY (channel EVENTS_CHANNEL).
+
+Writers call publish() inside their transaction, so the event is
+delivered only if (and when) the change commits:
+
+    async with get_conn() as conn:
+        ... UPDATE public.cars ...
+        await events.publish(conn, "car", car_id=cid, status="Rented")
+
+Each worker keeps ONE listening connection (outside the pool) and fans
+every event out to:
+- handlers registered with on(), e.g. to drop per-worker caches that a
+  write in another worker made stale
+- subscribers (one bounded queue per open GET /dashboard/stream)
+
+If the listening connection drops it reconnects with exponential backoff;
+events may have been missed meanwhile, so a "resync" event is sent.
+A subscriber that falls EVENTS_QUEUE_MAX events behind is also told to
+resync instead of buffering without limit.
+"""
+import asyncio
+import logging
+import os
+from typing import Callable, Optional
+import orjson
+import psycopg
+from psycopg import sql
+from db import DB_URL
+
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "gearup_events")
+EVENTS_QUEUE_MAX = int(os.getenv("EVENTS_QUEUE_MAX", "100"))
+EVENTS_BACKOFF_MAX_SEC = float(os.getenv("EVENTS_BACKOFF_MAX_SEC", "30"))
+
+logger = logging.getLogger(__name__)
+
+_handlers: dict = {}  # event type -> [fn(event)]
+_subscribers: set = set()
+_listener: Optional[asyncio.Task] = None
+_stats = {"connected": False, "received": 0, "reconnects": 0, "lagged": 0}
+
+RESYNC = {"type": "resync"}
+
+# ----------------- publishing -----------------
+async def publish(conn, type: str, **data):
+    """Queue an event on `conn`'s transaction; sent to listeners on commit."""
+    payload = orjson.dumps({"type": type, **data}).decode()
+    await conn.execute("SELECT pg_notify(%(ch)s, %(p)s)", {"ch": EVENTS_CHANNEL, "p": payload})
+
+async def publish_many(conn, type: str, items: list):
+    """publish() for a batch, in one statement: one event per dict in `items`."""
+    if not items:
+        return
+    payloads = [orjson.dumps({"type": type, **data}).decode() for data in items]
+    await conn.execute("SELECT pg_notify(%(ch)s, p) FROM unnest(%(ps)s::text[]) AS p",
+                       {"ch": EVENTS_CHANNEL, "ps": payloads})
+
+# ----------------- consuming -----------------
+def on(type: str, fn: Callable[[dict], None]):
+    """Run fn(event) in every worker for each `type` event (and on "resync")."""
+    _handlers.setdefault(type, []).append(fn)
+
+class Subscriber:
+    def __init__(self):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=EVENTS_QUEUE_MAX)
+
+    def put(self, event: dict):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            # too slow: drop the backlog, the client reloads everything instead
+            _stats["lagged"] += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+    async def get(self) -> dict:
+        return await self.queue.get()
+
+    def drain(self) -> list:
+        out = []
+        while not self.queue.empty():
+            out.append(self.queue.get_nowait())
+        return out
+
+def subscribe() -> Subscriber:
+    sub = Subscriber()
+    _subscribers.add(sub)
+    return sub
+
+def unsubscribe(sub: Subscriber):
+    _subscribers.discard(sub)
+
+def _dispatch(event: dict):
+    types = [event["type"]] if event["type"] != "resync" else list(_handlers)
+    for t in types:
+        for fn in _handlers.get(t, ()):
+            try:
+                fn(event)
+            except Exception:  # one bad handler mustn't stop the feed
+                logger.exception("event handler for %s failed", t)
+    for sub in list(_subscribers):
+        sub.put(event)
+
+async def _listen_forever():
+    backoff, first = 1.0, True
+    while True:
+        try:
+            async with await psycopg.AsyncConnection.connect(DB_URL, autocommit=True) as conn:
+                await conn.execute(sql.SQL("LISTEN {}").format(sql.Identifier(EVENTS_CHANNEL)))
+                _stats["connected"] = True
+                backoff = 1.0
+                if not first:
+                    _stats["reconnects"] += 1
+                    _dispatch(RESYNC)
+                async for n in conn.notifies():
+                    _stats["received"] += 1
+                    try:
+                        event = orjson.loads(n.payload)
+                    except orjson.JSONDecodeError:
+                        continue
+                    if isinstance(event, dict) and "type" in event:
+                        _dispatch(event)
+        except psycopg.Error as e:
+            logger.warning("event listener disconnected: %r; retrying in %.0fs", e, backoff)
+        finally:
+            _stats["connected"] = False
+        first = False
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, EVENTS_BACKOFF_MAX_SEC)
+
+def start():
+    global _listener
+    if _listener is None:
+        _listener = asyncio.create_task(_listen_forever())
+
+async def stop():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        try:
+            await _listener
+        except asyncio.CancelledError:
+            pass
+        _listener = None
+
+def stats() -> dict:
+    return {**_stats, "subscribers": len(_subscribers)}
@@ -0,0 +1,57 @@
+# exports.py
+"""
+Streaming CSV / NDJSON exports (GET /invoices/export, GET /payments/export).
+
+Rows are never materialized: CSV is produced by Postgres itself through
+COPY ... TO STDOUT, NDJSON is read through a server-side (named) cursor
+in batches of EXPORT_BATCH_ROWS. Memory stays constant regardless of the
+row count; each running export holds one pool connection until it ends.
+"""
+import os
+from decimal import Decimal
+from typing import Literal
+import orjson
+from fastapi.responses import StreamingResponse
+from db import get_conn
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+
+ExportFormat = Literal["csv", "ndjson"]
+
+def _default(v):
+    if isinstance(v, Decimal):
+        return float(v)
+    raise TypeError
+
+async def _stream_csv(sql: str, params: dict):
+    async with get_conn() as conn:
+        cur = conn.cursor()
+        async with cur.copy(f"COPY ({sql}) TO STDOUT WITH (FORMAT csv, HEADER)", params) as copy:
+            async for data in copy:
+                yield bytes(data)
+
+async def _stream_ndjson(sql: str, params: dict, name: str):
+    async with get_conn() as conn:
+        async with conn.cursor(name=name) as cur:
+            cur.itersize = EXPORT_BATCH_ROWS
+            await cur.execute(sql, params)
+            buf = []
+            async for row in cur:
+                buf.append(orjson.dumps(row, default=_default))
+                if len(buf) >= EXPORT_BATCH_ROWS:
+                    yield b"\n".join(buf) + b"\n"
+                    buf = []
+            if buf:
+                yield b"\n".join(buf) + b"\n"
+
+def export_response(sql: str, params: dict, fmt: ExportFormat, filename: str) -> StreamingResponse:
+    """sql must be a single SELECT (no trailing semicolon)."""
+    if fmt == "csv":
+        body, media_type = _stream_csv(sql, params), "text/csv"
+    else:
+        body, media_type = _stream_ndjson(sql, params, f"{filename}_export"), "application/x-ndjson"
+    return StreamingResponse(
+        body,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}.{fmt}"'},
+    )
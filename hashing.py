@@ -0,0 +1,154 @@
+# hashing.py
+import asyncio
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional
+from fastapi import HTTPException
+from passlib.context import CryptContext
+
+# bcrypt is pure CPU (~100-300 ms per call), so it runs in a dedicated process
+# pool instead of on the event loop (or Starlette's threadpool, which the GIL
+# would serialize anyway).
+HASH_WORKERS = max(1, int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 2))))
+# how many calls may wait for a free worker before we answer 503
+HASH_QUEUE_LIMIT = max(0, int(os.getenv("HASH_QUEUE_LIMIT", "32")))
+
+# hashing policy: new hashes use HASH_SCHEME at HASH_ROUNDS (bcrypt cost,
+# each +1 doubles login CPU). On a successful login any hash with another
+# scheme or another cost is rewritten, so changing these migrates users
+# gradually in both directions (stronger or cheaper).
+HASH_SCHEME = os.getenv("HASH_SCHEME", "bcrypt_sha256")
+HASH_ROUNDS = int(os.getenv("HASH_ROUNDS", "12"))
+if HASH_SCHEME not in ("bcrypt_sha256", "bcrypt"):
+    raise RuntimeError("HASH_SCHEME must be bcrypt_sha256 or bcrypt")
+
+pwd_context = CryptContext(
+    schemes=["bcrypt_sha256", "bcrypt"],
+    default=HASH_SCHEME,
+    deprecated="auto",
+    **{f"{scheme}__{opt}": HASH_ROUNDS
+       for scheme in ("bcrypt_sha256", "bcrypt")
+       for opt in ("default_rounds", "min_rounds", "max_rounds")},
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+_in_flight = 0
+_stats = {
+    "completed": 0,
+    "rejected": 0,
+    "hash_ms_total": 0.0,
+    "hash_ms_max": 0.0,
+    "wait_ms_total": 0.0,
+    "max_queue_depth": 0,
+    "upgrades": 0,
+    "pool_restarts": 0,
+}
+
+# ----------------- worker-side functions (must be picklable) -----------------
+def verify_and_update(plain: str, stored: str) -> tuple:
+    """(ok, new_hash); new_hash is set only when ok and the stored hash is off-policy."""
+    if not stored or not pwd_context.identify(stored):
+        return False, None
+    return pwd_context.verify_and_update(plain, stored)
+
+def hash_new(plain: str) -> str:
+    return pwd_context.hash(plain)
+
+def _timed(fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    return result, (time.perf_counter() - t0) * 1000
+
+# ----------------- lifecycle -----------------
+def start():
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=HASH_WORKERS)
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+def _discard(executor: ProcessPoolExecutor):
+    """Drop a pool whose worker died; the next start() builds a fresh one."""
+    global _executor
+    if _executor is executor:
+        _executor = None
+        _stats["pool_restarts"] += 1
+    executor.shutdown(wait=False, cancel_futures=True)
+
+# ----------------- async API -----------------
+def queue_depth() -> int:
+    return max(0, _in_flight - HASH_WORKERS)
+
+async def run(fn, *args):
+    """Run one of the functions above in the hashing pool, or 503 when saturated."""
+    global _in_flight
+    if _in_flight >= HASH_WORKERS + HASH_QUEUE_LIMIT:
+        _stats["rejected"] += 1
+        raise HTTPException(status_code=503, detail="Server busy, please try again",
+                            headers={"Retry-After": "1"})
+
+    _in_flight += 1
+    _stats["max_queue_depth"] = max(_stats["max_queue_depth"], queue_depth())
+    t0 = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    try:
+        # a worker killed mid-call (OOM, segfault) breaks the whole pool for
+        # good: replace it and retry once, then give up with a 503
+        for attempt in range(2):
+            start()
+            executor = _executor
+            try:
+                result, hash_ms = await loop.run_in_executor(executor, _timed, fn, *args)
+                break
+            except BrokenProcessPool:
+                _discard(executor)
+                if attempt:
+                    raise HTTPException(status_code=503, detail="Server busy, please try again",
+                                        headers={"Retry-After": "1"})
+    finally:
+        _in_flight -= 1
+
+    total_ms = (time.perf_counter() - t0) * 1000
+    _stats["completed"] += 1
+    _stats["hash_ms_total"] += hash_ms
+    _stats["hash_ms_max"] = max(_stats["hash_ms_max"], hash_ms)
+    _stats["wait_ms_total"] += max(total_ms - hash_ms, 0.0)
+    return result
+
+async def verify_password(plain: str, stored: str) -> tuple:
+    """
+    (ok, new_hash). Accepts bcrypt_sha256 and legacy bcrypt hashes; when
+    new_hash is not None the caller should store it (see auth.rehash_later).
+    """
+    ok, new_hash = await run(verify_and_update, plain, stored)
+    if new_hash:
+        _stats["upgrades"] += 1
+    return ok, new_hash
+
+async def hash_password(plain: str) -> str:
+    return await run(hash_new, plain)
+
+def stats() -> dict:
+    done = _stats["completed"] or 1
+    return {
+        "scheme": HASH_SCHEME,
+        "rounds": HASH_ROUNDS,
+        "workers": HASH_WORKERS,
+        "queue_limit": HASH_QUEUE_LIMIT,
+        "in_flight": _in_flight,
+        "queue_depth": queue_depth(),
+        "max_queue_depth": _stats["max_queue_depth"],
+        "completed": _stats["completed"],
+        "rejected": _stats["rejected"],
+        "upgrades": _stats["upgrades"],
+        "pool_restarts": _stats["pool_restarts"],
+        "hash_ms_avg": round(_stats["hash_ms_total"] / done, 2),
+        "hash_ms_max": round(_stats["hash_ms_max"], 2),
+        "wait_ms_avg": round(_stats["wait_ms_total"] / done, 2),
+    }
@@ -0,0 +1,136 @@
+# idempotency.py
+"""
+Idempotency-Key handling (public.idempotency_keys, see migrations/0004).
+
+Inside the route's transaction:
+    replay = await idempotency.begin(conn, scope, key, payload)
+    if replay is not None:
+        return replay
+    ... do the work ...
+    await idempotency.finish(conn, scope, key, result)
+
+The key row is claimed with the same transaction that does the work, so
+a concurrent retry blocks on it and then replays the committed result,
+and a failed request (rolled back) leaves no key behind.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Optional
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from psycopg.types.json import Jsonb
+from db import get_conn
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+IDEMPOTENCY_SWEEP_SEC = float(os.getenv("IDEMPOTENCY_SWEEP_SEC", "300"))
+SWEEP_BATCH = 5000
+
+logger = logging.getLogger(__name__)
+
+_sweeper: Optional[asyncio.Task] = None
+
+def _hash(payload) -> str:
+    return hashlib.sha256(payload.model_dump_json().encode()).hexdigest()
+
+def _replay(row: dict, request_hash: str) -> JSONResponse:
+    if row["request_hash"] != request_hash:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    if row["response"] is None:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    return JSONResponse(content=row["response"], headers={"Idempotent-Replayed": "true"})
+
+async def begin(conn, scope: str, key: Optional[str], payload) -> Optional[JSONResponse]:
+    """Stored response for a key already used, else claim the key and return None."""
+    if not key:
+        return None
+    if len(key) > 255:
+        raise HTTPException(status_code=400, detail="Idempotency-Key too long")
+    request_hash = _hash(payload)
+
+    cur = await conn.execute("""
+        SELECT request_hash, response
+        FROM public.idempotency_keys
+        WHERE scope = %(s)s AND key = %(k)s AND expires_at > now()
+    """, {"s": scope, "k": key})
+    row = await cur.fetchone()
+    if row:
+        return _replay(row, request_hash)
+
+    # claim it (or take over an expired one); blocks if another
+    # transaction holds the same key until that one commits/rolls back
+    cur = await conn.execute("""
+        INSERT INTO public.idempotency_keys (scope, key, request_hash, expires_at)
+        VALUES (%(s)s, %(k)s, %(h)s, now() + make_interval(secs => %(ttl)s))
+        ON CONFLICT (scope, key) DO UPDATE
+           SET request_hash = EXCLUDED.request_hash,
+               response     = NULL,
+               created_at   = now(),
+               expires_at   = EXCLUDED.expires_at
+         WHERE public.idempotency_keys.expires_at <= now()
+        RETURNING 1
+    """, {"s": scope, "k": key, "h": request_hash, "ttl": IDEMPOTENCY_TTL_HOURS * 3600})
+    if await cur.fetchone():
+        return None
+
+    # lost the race: the other request committed first
+    cur = await conn.execute("""
+        SELECT request_hash, response
+        FROM public.idempotency_keys
+        WHERE scope = %(s)s AND key = %(k)s
+    """, {"s": scope, "k": key})
+    row = await cur.fetchone()
+    if not row:
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+    return _replay(row, request_hash)
+
+async def finish(conn, scope: str, key: Optional[str], response: dict):
+    if not key:
+        return
+    await conn.execute("""
+        UPDATE public.idempotency_keys
+           SET response = %(r)s
+         WHERE scope = %(s)s AND key = %(k)s
+    """, {"r": Jsonb(response), "s": scope, "k": key})
+
+# ----------------- expiry sweeper -----------------
+async def sweep() -> int:
+    """Delete expired keys in bounded batches; returns rows deleted."""
+    total = 0
+    while True:
+        async with get_conn() as conn:
+            cur = await conn.execute("""
+                DELETE FROM public.idempotency_keys
+                WHERE ctid IN (
+                  SELECT ctid FROM public.idempotency_keys
+                  WHERE expires_at <= now()
+                  LIMIT %(n)s
+                )
+            """, {"n": SWEEP_BATCH})
+            total += cur.rowcount
+        if cur.rowcount < SWEEP_BATCH:
+            return total
+
+async def _sweep_forever():
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_SWEEP_SEC)
+        try:
+            await sweep()
+        except Exception:  # keep sweeping after transient DB errors
+            logger.exception("idempotency sweep failed")
+
+def start_sweeper():
+    global _sweeper
+    if _sweeper is None:
+        _sweeper = asyncio.create_task(_sweep_forever())
+
+async def stop_sweeper():
+    global _sweeper
+    if _sweeper is not None:
+        _sweeper.cancel()
+        try:
+            await _sweeper
+        except asyncio.CancelledError:
+            pass
+        _sweeper = None
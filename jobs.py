@@ -0,0 +1,198 @@
+# jobs.py
+"""
+In-process scheduled jobs for the reservation lifecycle.
+
+Every worker starts the runner from the FastAPI lifespan, but only the
+one holding the JOBS_LOCK_KEY advisory lock runs jobs. The lock is taken
+on a dedicated connection (outside the pool) and held for as long as that
+connection lives, so if the leader dies another worker takes over on its
+next tick.
+
+Jobs work in batches of JOBS_BATCH_SIZE rows claimed with
+FOR UPDATE SKIP LOCKED, one short transaction per batch, so they never
+wait on (or block) a rental being started/closed by staff.
+
+- expire_no_shows: Reserved past start_date + NO_SHOW_GRACE_DAYS -> Cancelled,
+                   invoice marked void (total_amount kept as billed)
+- flag_overdue:    Active past end_date -> overdue_at = now()
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Optional
+import psycopg
+from db import DB_URL, get_conn
+import events
+import revenue
+from routers.dashboard import invalidate_kpis
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") == "1"
+JOBS_TICK_SEC = float(os.getenv("JOBS_TICK_SEC", "30"))
+JOBS_BATCH_SIZE = int(os.getenv("JOBS_BATCH_SIZE", "500"))
+# cap per run so one sweep can't monopolize a pool connection
+JOBS_MAX_BATCHES = int(os.getenv("JOBS_MAX_BATCHES", "20"))
+NO_SHOW_GRACE_DAYS = int(os.getenv("NO_SHOW_GRACE_DAYS", "1"))
+# arbitrary constant, distinct from migrations' lock
+JOBS_LOCK_KEY = 727_002
+
+logger = logging.getLogger(__name__)
+
+_runner: Optional[asyncio.Task] = None
+_lock_conn: Optional[psycopg.AsyncConnection] = None
+_stats = {"leader": False, "jobs": {}}
+
+# ----------------- jobs -----------------
+async def _batched(step) -> int:
+    """Run step(conn) -> rows changed, one transaction per batch, until a short batch."""
+    total = 0
+    for _ in range(JOBS_MAX_BATCHES):
+        async with get_conn() as conn:
+            rows = await step(conn)
+            total += rows
+            if rows:
+                # KPI caches in every worker and open dashboard streams
+                await events.publish(conn, "kpis")
+        if rows < JOBS_BATCH_SIZE:
+            break
+    return total
+
+async def _expire_no_shows_batch(conn) -> int:
+    cur = await conn.execute("""
+        UPDATE public.reservations
+           SET status = 'Cancelled'
+         WHERE res_id IN (
+           SELECT res_id FROM public.reservations
+           WHERE status = 'Reserved'
+             AND start_date < CURRENT_DATE - %(grace)s::int
+           ORDER BY start_date
+           LIMIT %(n)s
+           FOR UPDATE SKIP LOCKED
+         )
+        RETURNING res_id
+    """, {"grace": NO_SHOW_GRACE_DAYS, "n": JOBS_BATCH_SIZE})
+    ids = [r["res_id"] for r in await cur.fetchall()]
+    if not ids:
+        return 0
+
+    # void the booking's invoice (migration 0007) so it leaves the unpaid KPI
+    # and the pending revenue total; total_amount stays as billed
+    cur = await conn.execute("""
+        SELECT inv_id, issue_date, total_amount, payment_status
+        FROM public.invoices
+        WHERE reservation_id = ANY(%(ids)s)
+        ORDER BY inv_id
+        FOR UPDATE
+    """, {"ids": ids})
+    old = {r["inv_id"]: r for r in await cur.fetchall()}
+    if old:
+        cur = await conn.execute("""
+            UPDATE public.invoices
+               SET payment_status = 'void'::payment_status
+             WHERE inv_id = ANY(%(ids)s)
+            RETURNING inv_id, issue_date, total_amount, payment_status
+        """, {"ids": list(old)})
+        await revenue.apply_changes(conn, [(old[r["inv_id"]], r) for r in await cur.fetchall()])
+    return len(ids)
+
+async def expire_no_shows() -> int:
+    return await _batched(_expire_no_shows_batch)
+
+async def _flag_overdue_batch(conn) -> int:
+    cur = await conn.execute("""
+        UPDATE public.reservations
+           SET overdue_at = now()
+         WHERE res_id IN (
+           SELECT res_id FROM public.reservations
+           WHERE status = 'Active'
+             AND end_date < CURRENT_DATE
+             AND overdue_at IS NULL
+           ORDER BY end_date
+           LIMIT %(n)s
+           FOR UPDATE SKIP LOCKED
+         )
+    """, {"n": JOBS_BATCH_SIZE})
+    return cur.rowcount
+
+async def flag_overdue() -> int:
+    return await _batched(_flag_overdue_batch)
+
+# name -> (interval seconds, coroutine function)
+JOBS = {
+    "expire_no_shows": (float(os.getenv("JOB_NO_SHOW_SEC", "300")), expire_no_shows),
+    "flag_overdue": (float(os.getenv("JOB_OVERDUE_SEC", "300")), flag_overdue),
+}
+
+# ----------------- leader election -----------------
+async def _is_leader() -> bool:
+    global _lock_conn
+    try:
+        if _lock_conn is None or _lock_conn.closed:
+            _lock_conn = await psycopg.AsyncConnection.connect(DB_URL, autocommit=True)
+            cur = await _lock_conn.execute("SELECT pg_try_advisory_lock(%s)", (JOBS_LOCK_KEY,))
+            _stats["leader"] = (await cur.fetchone())[0]
+            if not _stats["leader"]:
+                # don't hold a connection just to keep asking
+                await _lock_conn.close()
+                _lock_conn = None
+        else:
+            await _lock_conn.execute("SELECT 1")  # lock lives as long as this session
+    except psycopg.Error:
+        _stats["leader"] = False
+        if _lock_conn is not None:
+            await _lock_conn.close()
+            _lock_conn = None
+    return _stats["leader"]
+
+# ----------------- runner -----------------
+async def run_due(now: float) -> None:
+    for name, (interval, fn) in JOBS.items():
+        s = _stats["jobs"].setdefault(name, {"last_run": None, "last_rows": 0, "total_rows": 0,
+                                             "last_error": None, "_next": 0.0})
+        if now < s["_next"]:
+            continue
+        s["_next"] = now + interval
+        t0 = time.perf_counter()
+        try:
+            rows = await fn()
+        except Exception as e:  # keep the other jobs running
+            s["last_error"] = repr(e)
+            logger.exception("job %s failed", name)
+            continue
+        s.update(last_run=time.time(), last_rows=rows, total_rows=s["total_rows"] + rows,
+                 last_error=None, last_duration_ms=round((time.perf_counter() - t0) * 1000, 1))
+        if rows:
+            invalidate_kpis()
+
+async def _run_forever():
+    while True:
+        if await _is_leader():
+            await run_due(time.monotonic())
+        await asyncio.sleep(JOBS_TICK_SEC)
+
+def start():
+    global _runner
+    if JOBS_ENABLED and _runner is None:
+        _runner = asyncio.create_task(_run_forever())
+
+async def stop():
+    global _runner, _lock_conn
+    if _runner is not None:
+        _runner.cancel()
+        try:
+            await _runner
+        except asyncio.CancelledError:
+            pass
+        _runner = None
+    if _lock_conn is not None:
+        await _lock_conn.close()  # releases the advisory lock
+        _lock_conn = None
+        _stats["leader"] = False
+
+def stats() -> dict:
+    return {
+        "enabled": JOBS_ENABLED,
+        "leader": _stats["leader"],
+        "jobs": {name: {k: v for k, v in s.items() if not k.startswith("_")}
+                 for name, s in _stats["jobs"].items()},
+    }
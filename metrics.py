@@ -0,0 +1,156 @@
+# metrics.py
+"""
+Minimal in-process metrics exposed on GET /metrics in Prometheus text format.
+
+- MetricsMiddleware: per-route latency histogram, request/status counts,
+  in-flight gauge, DB queries per request
+- db.get_conn() reports pool wait and connection checkout (hold) time,
+  the latter also summed per route to show which router holds the pool
+- db's cursor factory counts queries into the current request
+
+Values are per worker process; Prometheus sums them across scrapes of
+each worker (or use a single worker per container).
+"""
+import contextvars
+import time
+from typing import Optional
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50)
+
+# per-request DB counters, set by the middleware and read by db.py
+_request_db: contextvars.ContextVar = contextvars.ContextVar("request_db", default=None)
+
+class Histogram:
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name, self.help, self.buckets, self.labels = name, help, buckets, labels
+        self._series: dict = {}  # label values -> [bucket counts..., sum, count]
+
+    def observe(self, value: float, *label_values):
+        s = self._series.get(label_values)
+        if s is None:
+            s = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+        for i, b in enumerate(self.buckets):
+            if value <= b:
+                s[i] += 1
+        s[-2] += value
+        s[-1] += 1
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for lv, s in self._series.items():
+            base = _labels(self.labels, lv)
+            for i, b in enumerate(self.buckets):
+                out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), lv + (_fmt(b),))} {s[i]}")
+            out.append(f"{self.name}_bucket{_labels(self.labels + ('le',), lv + ('+Inf',))} {s[-1]}")
+            out.append(f"{self.name}_sum{base} {s[-2]}")
+            out.append(f"{self.name}_count{base} {s[-1]}")
+        return out
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: dict = {}
+
+    def inc(self, *label_values, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def render(self) -> list:
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        out += [f"{self.name}{_labels(self.labels, lv)} {v}" for lv, v in self._values.items()]
+        return out
+
+def _fmt(v) -> str:
+    return repr(float(v)) if not isinstance(v, str) else v
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    esc = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in values)
+    return "{" + ",".join(f'{n}="{v}"' for n, v in zip(names, esc)) + "}"
+
+def _gauge(name: str, help: str, value) -> list:
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+http_latency = Histogram("http_request_duration_seconds", "Request latency by route.",
+                         LATENCY_BUCKETS, ("method", "route"))
+http_requests = Counter("http_requests_total", "Requests by route and status.",
+                        ("method", "route", "status"))
+db_queries_per_request = Histogram("db_queries_per_request", "DB statements executed per request.",
+                                   COUNT_BUCKETS, ("method", "route"))
+db_time_per_request = Histogram("db_checkout_seconds_per_request",
+                                "Total pool connection hold time per request.",
+                                LATENCY_BUCKETS, ("method", "route"))
+db_pool_wait = Histogram("db_pool_wait_seconds", "Time waiting for a pool connection.", LATENCY_BUCKETS)
+db_checkout = Histogram("db_connection_checkout_seconds", "Time a connection is held per get_conn().",
+                        LATENCY_BUCKETS)
+db_queries = Counter("db_queries_total", "DB statements executed.")
+_in_flight = 0
+
+# ----------------- hooks used by db.py -----------------
+def observe_pool_wait(seconds: float):
+    db_pool_wait.observe(seconds)
+
+def observe_checkout(seconds: float):
+    db_checkout.observe(seconds)
+    stats = _request_db.get()
+    if stats is not None:
+        stats["checkout"] += seconds
+
+def count_query():
+    db_queries.inc()
+    stats = _request_db.get()
+    if stats is not None:
+        stats["queries"] += 1
+
+# ----------------- ASGI middleware -----------------
+class MetricsMiddleware:
+    def __init__(self, app, skip_paths: tuple = ("/metrics",)):
+        self.app = app
+        self.skip_paths = skip_paths
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        global _in_flight
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = _request_db.set({"queries": 0, "checkout": 0.0})
+        _in_flight += 1
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - t0
+            _in_flight -= 1
+            db_stats = _request_db.get()
+            _request_db.reset(token)
+
+            route = scope.get("route")
+            # template path (/cars/{car_id}) keeps label cardinality bounded
+            label = getattr(route, "path", None) or "unmatched"
+            method = scope.get("method", "")
+            http_latency.observe(elapsed, method, label)
+            http_requests.inc(method, label, str(status["code"]))
+            db_queries_per_request.observe(db_stats["queries"], method, label)
+            db_time_per_request.observe(db_stats["checkout"], method, label)
+
+# ----------------- exposition -----------------
+def render(pool_stats: Optional[dict] = None, extra: Optional[dict] = None) -> str:
+    lines = []
+    for m in (http_latency, http_requests, db_queries_per_request, db_time_per_request,
+              db_pool_wait, db_checkout, db_queries):
+        lines += m.render()
+    lines += _gauge("http_requests_in_flight", "Requests currently being served.", _in_flight)
+    for key, value in (pool_stats or {}).items():
+        lines += _gauge(f"db_pool_{key.removeprefix('pool_')}", f"psycopg_pool stat {key}.", value)
+    for name, (help, value) in (extra or {}).items():
+        lines += _gauge(name, help, value)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,30 @@
+-- Double-booking protection enforced by Postgres instead of a
+-- SELECT-then-INSERT in routers/reservations.py.
+--
+-- Two Reserved/Active reservations for the same car may not overlap.
+-- daterange() is half-open [start_date, end_date), the same rule the API
+-- has always used (a car returned on day X can be picked up on day X).
+--
+-- NOTE: fails if the table already contains overlapping Reserved/Active
+-- rows; clean those up first.
+
+CREATE EXTENSION IF NOT EXISTS btree_gist;
+
+ALTER TABLE public.reservations
+  ADD CONSTRAINT reservations_no_overlap
+  EXCLUDE USING gist (
+    car_id WITH =,
+    daterange(start_date, end_date) WITH &&
+  )
+  WHERE (status IN ('Reserved', 'Active'));
+
+-- dashboard pickups / returns and lifecycle sweeps
+CREATE INDEX IF NOT EXISTS reservations_status_start_idx
+  ON public.reservations (status, start_date);
+
+CREATE INDEX IF NOT EXISTS reservations_status_end_idx
+  ON public.reservations (status, end_date);
+
+-- unpaid / partial invoice counts
+CREATE INDEX IF NOT EXISTS invoices_payment_status_idx
+  ON public.invoices (payment_status);
@@ -0,0 +1,18 @@
+-- Revenue rollup read by GET /dashboard/revenue instead of scanning
+-- public.invoices. One row per (invoice issue_date, payment_status).
+-- Kept up to date by revenue.apply_change() in the same transaction as
+-- each invoice write; `python -m revenue` rebuilds it from scratch.
+
+CREATE TABLE IF NOT EXISTS public.revenue_daily (
+  day            date           NOT NULL,
+  payment_status payment_status NOT NULL,
+  total_amount   numeric        NOT NULL DEFAULT 0,
+  invoice_count  integer        NOT NULL DEFAULT 0,
+  PRIMARY KEY (day, payment_status)
+);
+
+INSERT INTO public.revenue_daily (day, payment_status, total_amount, invoice_count)
+SELECT issue_date, payment_status, COALESCE(SUM(total_amount), 0), COUNT(*)
+FROM public.invoices
+GROUP BY issue_date, payment_status
+ON CONFLICT (day, payment_status) DO NOTHING;
@@ -0,0 +1,14 @@
+-- Keyset pagination for GET /invoices: ORDER BY created_at DESC, inv_id DESC
+CREATE INDEX IF NOT EXISTS invoices_created_keyset_idx
+  ON public.invoices (created_at DESC, inv_id DESC);
+
+-- same order within one payment_status filter
+CREATE INDEX IF NOT EXISTS invoices_status_created_keyset_idx
+  ON public.invoices (payment_status, created_at DESC, inv_id DESC);
+
+-- customer / car filters go through the reservation join
+CREATE INDEX IF NOT EXISTS reservations_customer_idx
+  ON public.reservations (customer_license_no);
+
+CREATE INDEX IF NOT EXISTS reservations_car_idx
+  ON public.reservations (car_id);
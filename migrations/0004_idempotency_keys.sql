@@ -0,0 +1,15 @@
+-- Idempotency-Key support for POST /payments/pay and
+-- POST /reservations/create_auth (see idempotency.py).
+CREATE TABLE IF NOT EXISTS public.idempotency_keys (
+  scope         text        NOT NULL,
+  key           text        NOT NULL,
+  request_hash  text        NOT NULL,
+  response      jsonb,
+  created_at    timestamptz NOT NULL DEFAULT now(),
+  expires_at    timestamptz NOT NULL,
+  PRIMARY KEY (scope, key)
+);
+
+-- sweeper deletes by expiry
+CREATE INDEX IF NOT EXISTS idempotency_keys_expires_idx
+  ON public.idempotency_keys (expires_at);
@@ -0,0 +1,13 @@
+-- Running paid total on each invoice, maintained by the payment
+-- transaction, so status is derived without re-summing public.payments.
+ALTER TABLE public.invoices
+  ADD COLUMN IF NOT EXISTS amount_paid numeric NOT NULL DEFAULT 0;
+
+UPDATE public.invoices i
+   SET amount_paid = s.paid
+  FROM (
+    SELECT invoice_id, SUM(amount) AS paid
+    FROM public.payments
+    GROUP BY invoice_id
+  ) s
+ WHERE i.inv_id = s.invoice_id;
@@ -0,0 +1,21 @@
+-- Reservation lifecycle sweeps (jobs.py).
+--
+-- No-shows (Reserved, start_date passed) are moved to Cancelled so they
+-- stop holding the car in reservations_no_overlap; overdue Active rentals
+-- keep their status and get overdue_at set instead.
+
+-- older databases may predate the Cancelled value
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'reservation_status' AND typtype = 'e')
+     AND NOT EXISTS (
+       SELECT 1 FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid
+       WHERE t.typname = 'reservation_status' AND e.enumlabel = 'Cancelled'
+     ) THEN
+    EXECUTE 'ALTER TYPE reservation_status ADD VALUE ''Cancelled''';
+  END IF;
+END
+$$;
+
+ALTER TABLE public.reservations
+  ADD COLUMN IF NOT EXISTS overdue_at timestamptz;
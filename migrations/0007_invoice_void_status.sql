@@ -0,0 +1,16 @@
+-- Invoices of expired no-shows (jobs.expire_no_shows) are marked void.
+--
+-- total_amount is left as billed; a void invoice counts neither as paid
+-- nor as pending, and revenue_daily keeps it in its own 'void' bucket.
+
+DO $$
+BEGIN
+  IF EXISTS (SELECT 1 FROM pg_type WHERE typname = 'payment_status' AND typtype = 'e')
+     AND NOT EXISTS (
+       SELECT 1 FROM pg_enum e JOIN pg_type t ON t.oid = e.enumtypid
+       WHERE t.typname = 'payment_status' AND e.enumlabel = 'void'
+     ) THEN
+    EXECUTE 'ALTER TYPE payment_status ADD VALUE ''void''';
+  END IF;
+END
+$$;
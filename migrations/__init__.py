@@ -0,0 +1,83 @@
+# migrations/__init__.py
+"""
+Versioned schema migrations.
+
+Each migration is a file NNNN_name.sql in this folder, applied once, in
+order, inside its own transaction. Applied versions are recorded in
+public.schema_migrations.
+
+Usage:
+    python -m migrations            # apply pending migrations
+    python -m migrations --status   # list applied / pending
+
+The app refuses to start while migrations are pending (the reservation
+overlap constraint, revenue_daily and amount_paid are required); the
+Procfile's release step applies them on every deploy.
+"""
+import os
+import re
+from pathlib import Path
+import psycopg
+
+MIGRATIONS_DIR = Path(__file__).parent
+# arbitrary constant so concurrent deploys don't run migrations twice
+_LOCK_KEY = 727_001
+
+def discover() -> list:
+    """[(version, name, path)] sorted by version."""
+    out = []
+    for p in MIGRATIONS_DIR.glob("*.sql"):
+        m = re.match(r"^(\d+)_(.+)\.sql$", p.name)
+        if m:
+            out.append((int(m.group(1)), m.group(2), p))
+    return sorted(out)
+
+def _ensure_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS public.schema_migrations (
+          version    integer PRIMARY KEY,
+          name       text NOT NULL,
+          applied_at timestamptz NOT NULL DEFAULT now()
+        )
+    """)
+
+def applied_versions(conn) -> set:
+    _ensure_table(conn)
+    rows = conn.execute("SELECT version FROM public.schema_migrations").fetchall()
+    return {r[0] for r in rows}
+
+def pending(db_url: str = None) -> list:
+    """[(version, name)] of migrations not yet applied."""
+    db_url = db_url or os.getenv("DATABASE_URL")
+    if not db_url:
+        raise RuntimeError("DATABASE_URL not set.")
+    with psycopg.connect(db_url, autocommit=True) as conn:
+        have = applied_versions(conn)
+    return [(version, name) for version, name, _ in discover() if version not in have]
+
+def migrate(db_url: str = None, verbose: bool = True) -> list:
+    """Apply every pending migration; returns the versions applied."""
+    db_url = db_url or os.getenv("DATABASE_URL")
+    if not db_url:
+        raise RuntimeError("DATABASE_URL not set.")
+
+    done = []
+    with psycopg.connect(db_url, autocommit=True) as conn:
+        conn.execute("SELECT pg_advisory_lock(%s)", (_LOCK_KEY,))
+        try:
+            have = applied_versions(conn)
+            for version, name, path in discover():
+                if version in have:
+                    continue
+                if verbose:
+                    print(f"applying {version:04d}_{name}")
+                with conn.transaction():
+                    conn.execute(path.read_text())
+                    conn.execute(
+                        "INSERT INTO public.schema_migrations (version, name) VALUES (%s, %s)",
+                        (version, name),
+                    )
+                done.append(version)
+        finally:
+            conn.execute("SELECT pg_advisory_unlock(%s)", (_LOCK_KEY,))
+    return done
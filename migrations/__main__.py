@@ -0,0 +1,18 @@
+# python -m migrations [--status]
+import os
+import sys
+import psycopg
+from dotenv import load_dotenv
+from migrations import discover, applied_versions, migrate
+
+load_dotenv()
+
+if __name__ == "__main__":
+    if "--status" in sys.argv[1:]:
+        with psycopg.connect(os.environ["DATABASE_URL"], autocommit=True) as conn:
+            have = applied_versions(conn)
+        for version, name, _ in discover():
+            print(f"{'applied' if version in have else 'pending'}  {version:04d}_{name}")
+    else:
+        applied = migrate()
+        print(f"{len(applied)} migration(s) applied")
@@ -0,0 +1,87 @@
+# ratelimit.py
+"""
+Token-bucket throttling for the credential endpoints (/auth/login,
+/auth/staff_login, /auth/reset_by_license), checked before the DB lookup
+and the bcrypt verify so abusive traffic is turned away cheaply.
+
+Limits are "<requests>/<seconds>" strings, e.g. LOGIN_RATE_IP=20/60 lets
+one IP burst 20 attempts and then refills at 20 per minute.
+
+The bucket store is pluggable: anything implementing RateLimitBackend can
+be installed with set_backend() (e.g. a Redis-backed one shared by all
+workers). The default InMemoryBackend is per process and takes an
+injectable clock so it can be exercised without sleeping.
+"""
+import os
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Callable, Optional
+from fastapi import HTTPException, Request
+
+def _parse_rate(spec: str) -> tuple:
+    count, _, seconds = spec.partition("/")
+    return int(count), float(seconds or 60)
+
+LOGIN_RATE_IP = _parse_rate(os.getenv("LOGIN_RATE_IP", "20/60"))
+LOGIN_RATE_EMAIL = _parse_rate(os.getenv("LOGIN_RATE_EMAIL", "5/60"))
+# Off by default: without a proxy in front, X-Forwarded-For is whatever the
+# client sends. Set RATE_LIMIT_TRUST_PROXY=1 behind Railway's proxy (the peer
+# address is then the proxy) to key on the entry the proxy appended.
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "0") == "1"
+
+# ----------------- backends -----------------
+class RateLimitBackend(ABC):
+    @abstractmethod
+    async def take(self, key: str, capacity: int, per_seconds: float) -> float:
+        """Consume one token from `key`'s bucket. Returns 0 if allowed,
+        otherwise the seconds until a token is available."""
+
+class InMemoryBackend(RateLimitBackend):
+    def __init__(self, max_keys: int = 100_000, clock: Callable[[], float] = time.monotonic):
+        self.max_keys = max_keys
+        self.clock = clock
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (tokens, updated_at)
+
+    async def take(self, key: str, capacity: int, per_seconds: float) -> float:
+        now = self.clock()
+        rate = capacity / per_seconds
+        tokens, updated = self._buckets.get(key, (float(capacity), now))
+        tokens = min(float(capacity), tokens + (now - updated) * rate)
+
+        if tokens >= 1:
+            self._buckets[key] = (tokens - 1, now)
+            retry_after = 0.0
+        else:
+            self._buckets[key] = (tokens, now)
+            retry_after = (1 - tokens) / rate
+        self._buckets.move_to_end(key)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return retry_after
+
+_backend: RateLimitBackend = InMemoryBackend()
+
+def set_backend(backend: RateLimitBackend):
+    global _backend
+    _backend = backend
+
+# ----------------- checks -----------------
+def client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        fwd = request.headers.get("x-forwarded-for")
+        if fwd:
+            return fwd.split(",")[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+async def check_login(request: Request, email: Optional[str] = None, scope: str = "login"):
+    """Raise 429 (with Retry-After) if this IP or this email is over its login budget."""
+    checks = [(f"{scope}:ip:{client_ip(request)}", LOGIN_RATE_IP)]
+    if email:
+        checks.append((f"{scope}:email:{email.strip().lower()}", LOGIN_RATE_EMAIL))
+
+    for key, (capacity, per_seconds) in checks:
+        wait = await _backend.take(key, capacity, per_seconds)
+        if wait > 0:
+            raise HTTPException(status_code=429, detail="Too many attempts, please try again later",
+                                headers={"Retry-After": str(max(1, int(wait + 0.999)))})
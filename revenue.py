@@ -0,0 +1,74 @@
+# revenue.py
+"""
+Incremental revenue rollup (public.revenue_daily, see migrations/0002).
+
+Every code path that inserts or updates an invoice calls apply_change()
+with the invoice's old and new (issue_date, payment_status, total_amount)
+inside the same transaction, so the rollup commits or rolls back with it.
+
+Rebuild from scratch (reconciliation):
+    python -m revenue
+"""
+import os
+from typing import Optional
+
+UPSERT_SQL = """
+    INSERT INTO public.revenue_daily (day, payment_status, total_amount, invoice_count)
+    VALUES (%(day)s, %(status)s::payment_status, %(amount)s, %(count)s)
+    ON CONFLICT (day, payment_status) DO UPDATE
+       SET total_amount  = public.revenue_daily.total_amount  + EXCLUDED.total_amount,
+           invoice_count = public.revenue_daily.invoice_count + EXCLUDED.invoice_count
+"""
+
+REBUILD_SQL = """
+    LOCK TABLE public.invoices IN SHARE MODE;
+    DELETE FROM public.revenue_daily;
+    INSERT INTO public.revenue_daily (day, payment_status, total_amount, invoice_count)
+    SELECT issue_date, payment_status, COALESCE(SUM(total_amount), 0), COUNT(*)
+    FROM public.invoices
+    GROUP BY issue_date, payment_status;
+"""
+
+def _deltas(changes: list) -> list:
+    """Net (day, status) changes over [(old, new)] invoice snapshots; no-ops dropped."""
+    acc = {}
+    for old, new in changes:
+        for inv, sign in ((old, -1), (new, 1)):
+            if not inv:
+                continue
+            key = (inv["issue_date"], str(inv["payment_status"]))
+            amount, count = acc.get(key, (0.0, 0))
+            acc[key] = (amount + sign * float(inv["total_amount"] or 0), count + sign)
+    return [
+        {"day": day, "status": status, "amount": amount, "count": count}
+        for (day, status), (amount, count) in acc.items()
+        if amount or count
+    ]
+
+async def apply_change(conn, old: Optional[dict], new: Optional[dict]):
+    """
+    old/new: invoice rows with issue_date, payment_status, total_amount
+    (old=None for an insert).
+    """
+    await apply_changes(conn, [(old, new)])
+
+async def apply_changes(conn, changes: list):
+    """Batch form of apply_change for [(old, new), ...]; one upsert per touched (day, status)."""
+    rows = _deltas(changes)
+    if rows:
+        async with conn.cursor() as cur:
+            await cur.executemany(UPSERT_SQL, rows)
+
+def rebuild(db_url: str = None):
+    import psycopg
+    db_url = db_url or os.getenv("DATABASE_URL")
+    if not db_url:
+        raise RuntimeError("DATABASE_URL not set.")
+    with psycopg.connect(db_url) as conn:
+        conn.execute(REBUILD_SQL)
+        return conn.execute("SELECT COUNT(*) FROM public.revenue_daily").fetchone()[0]
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+    print(f"revenue_daily rebuilt: {rebuild()} rows")
@@ -1,53 +1,213 @@
 # routers/auth.py
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone, date
 from typing import Optional, Literal
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Depends, Query, Request
 from pydantic import BaseModel, EmailStr, Field
-from passlib.hash import bcrypt_sha256, bcrypt
+import asyncio
+import hashlib
+import logging
+import time
 import jwt
 import os
 
 from db import get_conn
+from hashing import verify_password, hash_password
+import ratelimit
 
 router = APIRouter(prefix="/auth", tags=["auth"])
+logger = logging.getLogger(__name__)
 
 JWT_SECRET = os.getenv("JWT_SECRET", "dev-secret-change-me")
 JWT_EXPIRES_MIN = int(os.getenv("JWT_EXPIRES_MIN", "120"))
+# verified tokens kept in memory (LRU), each only until its own exp
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "2048"))
+
+# employee roles are re-read from public.employees at most this often
+ROLE_CACHE_SEC = float(os.getenv("ROLE_CACHE_SEC", "300"))
+
+STAFF_ROLES = ("employee", "admin")
+
+# lifetime of the ?ticket= that opens the dashboard event stream
+STREAM_TICKET_SEC = int(os.getenv("STREAM_TICKET_SEC", "30"))
+
+_token_cache: "OrderedDict[str, dict]" = OrderedDict()
+_role_cache: dict = {}  # emp_id -> (role or None, expires at monotonic time)
 
 # ----------------- helpers -----------------
-def verify_any(plain: str, stored: str) -> bool:
-    if not stored:
-        return False
-    if bcrypt_sha256.identify(stored):
-        return bcrypt_sha256.verify(plain, stored)
-    if bcrypt.identify(stored):
-        return bcrypt.verify(plain, stored)
-    return False
-
-def make_token(sub: str, email: str) -> str:
+def make_token(sub: str, email: str, kind: Literal["customer", "employee"] = "customer",
+               role: Optional[str] = None) -> str:
     """sub = customers.license_no OR employees.emp_id"""
     now = datetime.now(timezone.utc)
     payload = {
         "sub": sub,
         "email": email,
+        "kind": kind,
         "iat": int(now.timestamp()),
         "exp": int((now + timedelta(minutes=JWT_EXPIRES_MIN)).timestamp()),
     }
+    if role:
+        payload["role"] = role
     return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
 
 def verify_token(auth_header: Optional[str]) -> Optional[dict]:
     if not auth_header or not auth_header.lower().startswith("bearer "):
         return None
-    token = auth_header.split(" ", 1)[1]
+    token = auth_header.split(" ", 1)[1].strip()
+    key = hashlib.sha256(token.encode()).hexdigest()
+
+    claims = _token_cache.get(key)
+    if claims is not None:
+        if claims["exp"] > time.time():
+            _token_cache.move_to_end(key)
+            return claims
+        del _token_cache[key]
+
     try:
-        return jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
+        claims = jwt.decode(token, JWT_SECRET, algorithms=["HS256"])
     except jwt.PyJWTError:
         return None
+    if "exp" in claims:
+        _token_cache[key] = claims
+        if len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return claims
+
+def make_stream_ticket(principal: "Principal") -> str:
+    """Short-lived token that only opens GET /dashboard/stream (sent as ?ticket=)."""
+    now = datetime.now(timezone.utc)
+    payload = {
+        "sub": principal.sub,
+        "email": principal.email,
+        "kind": principal.kind,
+        "scope": "stream",
+        "iat": int(now.timestamp()),
+        "exp": int((now + timedelta(seconds=STREAM_TICKET_SEC)).timestamp()),
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm="HS256")
+
+def verify_stream_ticket(ticket: str) -> Optional[dict]:
+    claims = verify_token(f"Bearer {ticket}")
+    return claims if claims and claims.get("scope") == "stream" else None
+
+_REHASH_SQL = {
+    "employee": """
+        update public.employees set password_hash = %(new)s
+         where emp_id = %(id)s and password_hash = %(old)s
+    """,
+    "customer": """
+        update public.customers set password_hash = %(new)s
+         where license_no = %(id)s and password_hash = %(old)s
+    """,
+}
+_rehash_tasks: set = set()
+
+async def _store_rehash(kind: str, key: str, old_hash: str, new_hash: str):
+    try:
+        async with get_conn() as conn:
+            # compare-and-set: skip if the password changed meanwhile
+            await conn.execute(_REHASH_SQL[kind], {"new": new_hash, "id": key, "old": old_hash})
+    except Exception:  # best effort; the next login retries
+        logger.warning("password rehash failed for %s %s", kind, key, exc_info=True)
+
+def rehash_later(kind: Literal["customer", "employee"], key: str, old_hash: str, new_hash: Optional[str]):
+    """Write an upgraded hash (hashing policy changed) after the response is sent."""
+    if not new_hash:
+        return
+    task = asyncio.create_task(_store_rehash(kind, key, old_hash, new_hash))
+    _rehash_tasks.add(task)
+    task.add_done_callback(_rehash_tasks.discard)
 
 def _norm_license(s: str) -> str:
     # remove spaces/dashes and uppercase
     return "".join(ch for ch in str(s).strip() if ch.isalnum()).upper()
 
+# ----------------- principal -----------------
+class Principal(BaseModel):
+    kind: Literal["customer", "employee"]
+    sub: str            # license_no for customers, emp_id for employees
+    email: str
+    role: Optional[str] = None  # employees: role at login time
+
+def _principal(claims: dict) -> Principal:
+    kind = claims.get("kind")
+    if kind not in ("customer", "employee"):
+        # tokens issued before "kind" existed: employee ids look like EMP-#
+        kind = "employee" if str(claims["sub"]).upper().startswith("EMP-") else "customer"
+    return Principal(kind=kind, sub=claims["sub"], email=claims.get("email", ""),
+                     role=claims.get("role"))
+
+async def optional_principal(authorization: Optional[str] = Header(None)) -> Optional[Principal]:
+    """FastAPI dependency; resolved once per request and shared by every Depends() on it."""
+    claims = verify_token(authorization)
+    if not claims or claims.get("scope"):
+        return None  # scoped tickets (stream) are not bearer tokens
+    return _principal(claims)
+
+async def get_principal(principal: Optional[Principal] = Depends(optional_principal)) -> Principal:
+    if principal is None:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return principal
+
+async def get_principal_or_ticket(principal: Optional[Principal] = Depends(optional_principal),
+                                  ticket: Optional[str] = Query(None)) -> Principal:
+    """Like get_principal, but also accepts ?ticket= from make_stream_ticket()
+    (EventSource can't send headers; the bearer token never goes in a URL)."""
+    if principal is None and ticket:
+        claims = verify_stream_ticket(ticket)
+        principal = _principal(claims) if claims else None
+    return await get_principal(principal)
+
+async def get_customer(principal: Principal = Depends(get_principal)) -> Principal:
+    if principal.kind != "customer":
+        raise HTTPException(status_code=403, detail="Customer account required")
+    return principal
+
+# ----------------- staff roles -----------------
+def cache_role(emp_id: str, role: Optional[str]):
+    _role_cache[emp_id] = (role, time.monotonic() + ROLE_CACHE_SEC)
+
+def invalidate_role(emp_id: Optional[str] = None):
+    """Call after changing an employee's role (or with no args to drop them all)."""
+    if emp_id is None:
+        _role_cache.clear()
+    else:
+        _role_cache.pop(emp_id, None)
+
+async def _employee_role(emp_id: str) -> Optional[str]:
+    hit = _role_cache.get(emp_id)
+    if hit and hit[1] > time.monotonic():
+        return hit[0]
+    async with get_conn() as conn:
+        cur = await conn.execute("""
+            select lower(role) as role
+            from public.employees
+            where emp_id = %(id)s
+        """, {"id": emp_id})
+        row = await cur.fetchone()
+    role = row["role"] if row else None
+    cache_role(emp_id, role)
+    return role
+
+def require_role(*roles: str, stream_ticket: bool = False):
+    """
+    Dependency factory for staff routes, e.g.
+        @router.post("/pay", dependencies=[Depends(require_role("admin"))])
+    The role comes from the role cache (seeded by staff_login), not the token,
+    so demotions apply within ROLE_CACHE_SEC. stream_ticket=True also accepts
+    a stream ticket as ?ticket= (only for GET streams opened by EventSource).
+    """
+    source = get_principal_or_ticket if stream_ticket else get_principal
+
+    async def dependency(principal: Principal = Depends(source)) -> Principal:
+        if principal.kind != "employee":
+            raise HTTPException(status_code=403, detail="Staff account required")
+        role = await _employee_role(principal.sub)
+        if role not in roles:
+            raise HTTPException(status_code=403, detail="Insufficient role")
+        return principal.model_copy(update={"role": role})
+    return dependency
+
 # ----------------- models -----------------
 class StaffLoginIn(BaseModel):
     email: EmailStr
@@ -75,12 +235,13 @@ class ResetByLicenseIn(BaseModel):
 
 # ----------------- staff auth -----------------
 @router.post("/staff_login")
-def staff_login(payload: StaffLoginIn):
+async def staff_login(payload: StaffLoginIn, request: Request):
     email = payload.email.strip().lower()
     role  = payload.role.strip().lower()
+    await ratelimit.check_login(request, email, scope="staff_login")
 
-    with get_conn() as conn:
-        row = conn.execute("""
+    async with get_conn() as conn:
+        cur = await conn.execute("""
             select emp_id, email, lower(role) as role,
                    coalesce(password_hash,'') as password_hash,
                    first_name, last_name
@@ -88,12 +249,18 @@ def staff_login(payload: StaffLoginIn):
             where lower(email) = %(e)s
               and lower(role)  = %(r)s
             limit 1
-        """, {"e": email, "r": role}).fetchone()
+        """, {"e": email, "r": role})
+        row = await cur.fetchone()
 
-    if (not row) or (not verify_any(payload.password, row["password_hash"])):
+    if not row:
         raise HTTPException(status_code=401, detail="Invalid credentials or role")
+    ok, new_hash = await verify_password(payload.password, row["password_hash"])
+    if not ok:
+        raise HTTPException(status_code=401, detail="Invalid credentials or role")
+    rehash_later("employee", row["emp_id"], row["password_hash"], new_hash)
 
-    token = make_token(row["emp_id"], row["email"])  # sub = EMP-#
+    cache_role(row["emp_id"], row["role"])
+    token = make_token(row["emp_id"], row["email"], kind="employee", role=row["role"])  # sub = EMP-#
     return {
         "token": token,
         "employee": {
@@ -107,7 +274,7 @@ def staff_login(payload: StaffLoginIn):
 
 # ----------------- customer auth -----------------
 @router.post("/signup")
-def signup(payload: SignUpIn):
+async def signup(payload: SignUpIn):
     # parse/validate dates
     try:
         dob = date.fromisoformat(payload.date_of_birth)
@@ -128,21 +295,26 @@ def signup(payload: SignUpIn):
     if lic_exp <= today:
         raise HTTPException(status_code=400, detail="License expiry must be a future date.")
 
-    with get_conn() as conn:
+    # hash before taking a pooled connection: the wait on the hashing pool can
+    # be long under load and must not hold a DB connection meanwhile
+    pwd_hash = await hash_password(payload.password)
+
+    async with get_conn() as conn:
         # unique email
-        exists = conn.execute("select 1 from public.customers where lower(email)=%(e)s",
-                              {"e": payload.email.lower()}).fetchone()
+        cur = await conn.execute("select 1 from public.customers where lower(email)=%(e)s",
+                                 {"e": payload.email.lower()})
+        exists = await cur.fetchone()
         if exists:
             raise HTTPException(status_code=409, detail="Email already registered")
 
         # optional: unique license_no too (DB has PK, this just gives friendlier error)
-        lic_exists = conn.execute("select 1 from public.customers where license_no=%(l)s",
-                                  {"l": payload.license_no}).fetchone()
+        cur = await conn.execute("select 1 from public.customers where license_no=%(l)s",
+                                 {"l": payload.license_no})
+        lic_exists = await cur.fetchone()
         if lic_exists:
             raise HTTPException(status_code=409, detail="License number already registered")
 
-        pwd_hash = bcrypt_sha256.hash(payload.password)
-        row = conn.execute("""
+        cur = await conn.execute("""
           insert into public.customers (
             license_no, first_name, last_name, email, phone,
             license_expiry, date_of_birth, address_street, address_city, password_hash
@@ -160,24 +332,31 @@ def signup(payload: SignUpIn):
           "lex": payload.license_expiry,
           "dob": payload.date_of_birth,
           "phash": pwd_hash
-        }).fetchone()
+        })
+        row = await cur.fetchone()
 
     token = make_token(row["license_no"], row["email"])  # sub = license_no
     return {"token": token, "customer": row}
 
 @router.post("/login")
-def login(payload: LoginIn):
-    with get_conn() as conn:
-        user = conn.execute("""
+async def login(payload: LoginIn, request: Request):
+    await ratelimit.check_login(request, payload.email, scope="login")
+    async with get_conn() as conn:
+        cur = await conn.execute("""
             select license_no, email, coalesce(password_hash,'') as password_hash,
                    first_name, last_name
             from public.customers
             where lower(email) = %(e)s
             limit 1
-        """, {"e": payload.email.lower()}).fetchone()
+        """, {"e": payload.email.lower()})
+        user = await cur.fetchone()
 
-    if (not user) or (not user["password_hash"]) or (not bcrypt_sha256.verify(payload.password, user["password_hash"])):
+    if (not user) or (not user["password_hash"]):
+        raise HTTPException(status_code=401, detail="Invalid email or password")
+    ok, new_hash = await verify_password(payload.password, user["password_hash"])
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid email or password")
+    rehash_later("customer", user["license_no"], user["password_hash"], new_hash)
 
     token = make_token(user["license_no"], user["email"])  # sub = license_no
     return {
@@ -191,23 +370,27 @@ def login(payload: LoginIn):
     }
 
 @router.post("/reset_by_license")
-def reset_by_license(payload: ResetByLicenseIn):
+async def reset_by_license(payload: ResetByLicenseIn, request: Request):
     email = payload.email.strip().lower()
+    await ratelimit.check_login(request, email, scope="reset")
     lic_in = _norm_license(payload.license_no)
 
-    with get_conn() as conn:
-        row = conn.execute("""
+    async with get_conn() as conn:
+        cur = await conn.execute("""
             select license_no, email
             from public.customers
             where lower(email) = %(e)s
             limit 1
-        """, {"e": email}).fetchone()
+        """, {"e": email})
+        row = await cur.fetchone()
 
-        if not row or _norm_license(row["license_no"]) != lic_in:
-            raise HTTPException(status_code=401, detail="Invalid email or license number")
+    if not row or _norm_license(row["license_no"]) != lic_in:
+        raise HTTPException(status_code=401, detail="Invalid email or license number")
 
-        new_hash = bcrypt_sha256.hash(payload.new_password)
-        conn.execute("""
+    # hash with no connection checked out (see signup)
+    new_hash = await hash_password(payload.new_password)
+    async with get_conn() as conn:
+        await conn.execute("""
             update public.customers
                set password_hash = %(h)s
              where license_no = %(lic)s
@@ -216,13 +399,10 @@ def reset_by_license(payload: ResetByLicenseIn):
     return {"ok": True, "message": "Password has been reset"}
 
 @router.get("/me")
-def me(authorization: Optional[str] = Header(None)):
-    claims = verify_token(authorization)
-    if not claims:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    return {"sub": claims["sub"], "email": claims["email"]}
+async def me(principal: Principal = Depends(get_principal)):
+    return {"sub": principal.sub, "email": principal.email, "kind": principal.kind, "role": principal.role}
 
 @router.post("/logout")
-def logout():
+async def logout():
     # stateless JWT: frontend just deletes its token
     return {"ok": True}
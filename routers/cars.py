@@ -1,12 +1,29 @@
-from fastapi import APIRouter, HTTPException
+import os
+from datetime import date
+from fastapi import APIRouter, HTTPException, Header, Depends
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from pydantic import BaseModel
 from typing import Optional
 from db import get_conn
+import catalog
+import events
+from routers.auth import require_role, STAFF_ROLES
 
 router = APIRouter(prefix="/cars", tags=["cars"])
 
+# e.g. "public, max-age=30" behind a CDN; default makes browsers revalidate via ETag
+CARS_CACHE_CONTROL = os.getenv("CARS_CACHE_CONTROL", "no-cache")
+
+# keep every worker's fleet cache in step with writes made by the others
+def _on_car_event(event: dict):
+    if event["type"] == "car" and set(event) <= {"type", "car_id", "status"} and "status" in event:
+        catalog.set_status(event["car_id"], event["status"])
+    else:
+        catalog.invalidate()
+
+events.on("car", _on_car_event)
+
 class CarUpdate(BaseModel):
     brand: Optional[str] = None
     model: Optional[str] = None
@@ -17,105 +34,121 @@ class CarUpdate(BaseModel):
     status: Optional[str] = None
 
 @router.get("")
-def list_cars(
+async def list_cars(
     category: str | None = None,
     seats: int | None = None,
     transmission: str | None = None,
     min_price: float | None = None,
     max_price: float | None = None,
+    if_none_match: Optional[str] = Header(None),
 ):
-    sql = """
-      SELECT
-        car_id               AS id,
-        plate_no,
-        brand, model, year,
-        category::text       AS category,
-        fuel_type,
-        color,
-        seats,
-        transmission::text   AS transmission,
-        price_per_day::float AS price_per_day,
-        status::text         AS status,
-        COALESCE(photo_url,'') AS photo_url,
-        created_at
-      FROM public.cars
-      WHERE 1=1
-    """
-    where, params = [], {}
-
-    if category:
-        where.append("AND category = %(cat)s::car_category")
-        params["cat"] = category
-    if seats:
-        where.append("AND seats >= %(seats)s")
-        params["seats"] = seats
-    if transmission:
-        where.append("AND transmission = %(tr)s::transmission_type")
-        params["tr"] = transmission
-    if min_price is not None:
-        where.append("AND price_per_day >= %(pmin)s")
-        params["pmin"] = min_price
-    if max_price is not None:
-        where.append("AND price_per_day <= %(pmax)s")
-        params["pmax"] = max_price
-
-    sql += " ".join(where) + " ORDER BY price_per_day, brand, model"
-
-    with get_conn() as conn:
-        rows = conn.execute(sql, params).fetchall()
+    # served pre-encoded from the in-process fleet cache (see catalog.py)
+    etag, body = await catalog.get_encoded(category, seats, transmission, min_price, max_price)
+    headers = {"Cache-Control": CARS_CACHE_CONTROL}
+    if etag is None:
+        return Response(content=body, media_type="application/json", headers=headers)
+
+    headers["ETag"] = etag
+    if if_none_match and _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return any(t == etag or t == "W/" + etag for t in tags)
+
+
+@router.get("/available")
+async def list_available_cars(
+    start: date,
+    end: date,
+    category: str | None = None,
+    seats: int | None = None,
+    transmission: str | None = None,
+    min_price: float | None = None,
+    max_price: float | None = None,
+):
+    """Cars with no Reserved/Active reservation overlapping [start, end)."""
+    if start < date.today():
+        raise HTTPException(status_code=400, detail="start cannot be in the past")
+    if end <= start:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    # same overlap rule as reservations.create_reservation_authed, as an anti-join
+    async with get_conn() as conn:
+        cur = await conn.execute("""
+          SELECT
+            c.car_id               AS id,
+            c.plate_no,
+            c.brand, c.model, c.year,
+            c.category::text       AS category,
+            c.fuel_type,
+            c.color,
+            c.seats,
+            c.transmission::text   AS transmission,
+            c.price_per_day::float AS price_per_day,
+            c.status::text         AS status,
+            COALESCE(c.photo_url,'') AS photo_url,
+            c.created_at
+          FROM public.cars c
+          WHERE NOT EXISTS (
+                  SELECT 1
+                  FROM public.reservations r
+                  WHERE r.car_id = c.car_id
+                    AND r.status IN ('Reserved','Active')
+                    AND r.start_date < %(end)s
+                    AND r.end_date   > %(start)s
+                )
+            AND (%(cat)s::text  IS NULL OR c.category::text = %(cat)s)
+            AND (%(seats)s::int IS NULL OR c.seats >= %(seats)s)
+            AND (%(tr)s::text   IS NULL OR c.transmission::text = %(tr)s)
+            AND (%(pmin)s::numeric IS NULL OR c.price_per_day >= %(pmin)s)
+            AND (%(pmax)s::numeric IS NULL OR c.price_per_day <= %(pmax)s)
+          ORDER BY c.price_per_day, c.brand, c.model
+        """, {
+            "start": start,
+            "end": end,
+            "cat": category or None,
+            "seats": seats or None,
+            "tr": transmission or None,
+            "pmin": min_price,
+            "pmax": max_price,
+        })
+        rows = await cur.fetchall()
 
     return JSONResponse(content=jsonable_encoder(rows))
 
 
-@router.put("/{car_id}")
-def update_car(car_id: str, car: CarUpdate):
+@router.put("/{car_id}", dependencies=[Depends(require_role(*STAFF_ROLES))])
+async def update_car(car_id: str, car: CarUpdate):
     """Update car details - staff only"""
     
-    with get_conn() as conn:
-        # Check if car exists
-        existing = conn.execute(
-            "SELECT car_id FROM public.cars WHERE car_id = %(id)s",
-            {"id": car_id}
-        ).fetchone()
-        
-        if not existing:
-            raise HTTPException(status_code=404, detail="Car not found")
-        
-        # Build update query dynamically
-        updates = []
-        params = {"car_id": car_id}
-        
-        if car.brand is not None:
-            updates.append("brand = %(brand)s")
-            params["brand"] = car.brand
-        if car.model is not None:
-            updates.append("model = %(model)s")
-            params["model"] = car.model
-        if car.year is not None:
-            updates.append("year = %(year)s")
-            params["year"] = car.year
-        if car.category is not None:
-            updates.append("category = %(category)s::car_category")
-            params["category"] = car.category
-        if car.transmission is not None:
-            updates.append("transmission = %(transmission)s::transmission_type")
-            params["transmission"] = car.transmission
-        if car.price_per_day is not None:
-            updates.append("price_per_day = %(price_per_day)s")
-            params["price_per_day"] = car.price_per_day
-        if car.status is not None:
-            updates.append("status = %(status)s::car_status")
-            params["status"] = car.status
-        
-        if not updates:
-            raise HTTPException(status_code=400, detail="No fields to update")
-        
-        query = f"""
+    changes = car.model_dump(exclude_none=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No fields to update")
+
+    async with get_conn() as conn:
+        # one fixed statement for every field combination (NULL = keep), so
+        # psycopg prepares it once per connection instead of per shape
+        cur = await conn.execute("""
             UPDATE public.cars
-            SET {', '.join(updates)}
-            WHERE car_id = %(car_id)s
-        """
-        
-        conn.execute(query, params)
-    
+               SET brand         = COALESCE(%(brand)s::text, brand),
+                   model         = COALESCE(%(model)s::text, model),
+                   year          = COALESCE(%(year)s::int, year),
+                   category      = COALESCE(%(category)s::car_category, category),
+                   transmission  = COALESCE(%(transmission)s::transmission_type, transmission),
+                   price_per_day = COALESCE(%(price_per_day)s::numeric, price_per_day),
+                   status        = COALESCE(%(status)s::car_status, status)
+             WHERE car_id = %(car_id)s
+            RETURNING car_id
+        """, {**car.model_dump(), "car_id": car_id})
+        if not await cur.fetchone():
+            raise HTTPException(status_code=404, detail="Car not found")
+
+        await events.publish(conn, "car", car_id=car_id, **changes)
+
+    catalog.invalidate()
     return {"message": "Car updated successfully", "car_id": car_id}
\ No newline at end of file
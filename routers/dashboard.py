@@ -1,83 +1,328 @@
-from fastapi import APIRouter
+import asyncio
+import os
+import time
+from typing import Literal, Optional
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import StreamingResponse
 from db import get_conn
-from datetime import date
+import events
+from routers.auth import Principal, get_principal, make_stream_ticket, require_role, STAFF_ROLES, STREAM_TICKET_SEC
+from datetime import date, timedelta
 
-router = APIRouter(prefix="/dashboard", tags=["dashboard"])
+router = APIRouter(prefix="/dashboard", tags=["dashboard"],
+                   dependencies=[Depends(require_role(*STAFF_ROLES))])
+# EventSource can't send an Authorization header, so the stream takes a
+# short-lived ?ticket= from POST /dashboard/stream-ticket instead
+stream_router = APIRouter(prefix="/dashboard", tags=["dashboard"],
+                          dependencies=[Depends(require_role(*STAFF_ROLES, stream_ticket=True))])
+
+# KPI results are shared by every open staff tab for a few seconds
+KPI_CACHE_SEC = float(os.getenv("KPI_CACHE_SEC", "5"))
+
+_kpi_cache = {"value": None, "at": 0.0, "day": None}
+_kpi_inflight: Optional[asyncio.Task] = None
+
+def invalidate_kpis():
+    """Called by rentals/payments after they change reservation or invoice state."""
+    global _kpi_inflight
+    _kpi_cache["value"] = None
+    _kpi_inflight = None  # a query already running may predate the change; don't cache it
+
+# writes in other workers arrive through events.py
+events.on("kpis", lambda event: invalidate_kpis())
+
+async def _query_kpis(today: date) -> dict:
+    async with get_conn() as conn:
+        cur = await conn.execute("""
+            SELECT
+              (SELECT COUNT(*) FROM public.reservations
+                WHERE status = 'Reserved' AND start_date = %(today)s)  AS todays_pickups,
+              (SELECT COUNT(*) FROM public.reservations
+                WHERE status = 'Active' AND end_date = %(today)s)      AS todays_returns,
+              (SELECT COUNT(*) FROM public.reservations
+                WHERE status = 'Active')                               AS active_rentals,
+              (SELECT COUNT(*) FROM public.reservations
+                WHERE status = 'Active' AND overdue_at IS NOT NULL)    AS overdue_rentals,
+              (SELECT COUNT(*) FROM public.invoices
+                WHERE payment_status IN ('unpaid', 'partial'))         AS unpaid_invoices
+        """, {"today": today})
+        return dict(await cur.fetchone())
 
 @router.get("/kpis")
-def get_kpis():
+async def get_kpis():
     """
     Returns KPI metrics for staff dashboard:
     - Today's pickups (reservations starting today)
     - Today's returns (reservations ending today)
     - Active rentals (currently ongoing)
+    - Overdue rentals (flagged by jobs.flag_overdue)
     - Unpaid invoices count
     """
+    global _kpi_inflight
     today = date.today()
-    
-    with get_conn() as conn:
-        # Today's pickups - reservations that start today and are Reserved
-        pickups = conn.execute("""
-            SELECT COUNT(*) as count
-            FROM public.reservations
-            WHERE start_date = %(today)s
-              AND status = 'Reserved'
-        """, {"today": today}).fetchone()["count"]
-        
-        # Today's returns - reservations that end today and are Active
-        returns = conn.execute("""
-            SELECT COUNT(*) as count
-            FROM public.reservations
-            WHERE end_date = %(today)s
-              AND status = 'Active'
-        """, {"today": today}).fetchone()["count"]
-        
-        # Active rentals - currently ongoing
-        active = conn.execute("""
-            SELECT COUNT(*) as count
-            FROM public.reservations
-            WHERE status = 'Active'
-        """).fetchone()["count"]
-        
-        # Unpaid invoices
-        unpaid = conn.execute("""
-            SELECT COUNT(*) as count
-            FROM public.invoices
-            WHERE payment_status IN ('unpaid', 'partial')
-        """).fetchone()["count"]
-    
-    return {
-        "todays_pickups": pickups,
-        "todays_returns": returns,
-        "active_rentals": active,
-        "unpaid_invoices": unpaid
-    }
+
+    cached = _kpi_cache["value"]
+    if cached is not None and _kpi_cache["day"] == today \
+            and time.monotonic() - _kpi_cache["at"] < KPI_CACHE_SEC:
+        return cached
+
+    # single-flight: concurrent refreshes await the same query
+    if _kpi_inflight is None or _kpi_inflight.done():
+        _kpi_inflight = asyncio.ensure_future(_query_kpis(today))
+    task = _kpi_inflight
+    value = await asyncio.shield(task)
+
+    if task is _kpi_inflight:
+        _kpi_cache.update(value=value, at=time.monotonic(), day=today)
+    return value
 
 @router.get("/revenue")
-def get_revenue_stats():
+async def get_revenue_stats():
     """
     Revenue statistics:
     - Total revenue (all paid invoices)
     - Pending revenue (unpaid/partial)
     - This month's revenue
     """
-    with get_conn() as conn:
-        stats = conn.execute("""
+    # reads the per-day rollup (revenue.py) instead of scanning public.invoices
+    async with get_conn() as conn:
+        cur = await conn.execute("""
             SELECT
-                SUM(CASE WHEN payment_status = 'paid' THEN total_amount ELSE 0 END) as total_revenue,
-                SUM(CASE WHEN payment_status IN ('unpaid', 'partial') THEN total_amount ELSE 0 END) as pending_revenue,
-                SUM(CASE 
-                    WHEN payment_status = 'paid' 
-                    AND EXTRACT(MONTH FROM issue_date) = EXTRACT(MONTH FROM CURRENT_DATE)
-                    AND EXTRACT(YEAR FROM issue_date) = EXTRACT(YEAR FROM CURRENT_DATE)
-                    THEN total_amount 
-                    ELSE 0 
-                END) as this_month_revenue
-            FROM public.invoices
-        """).fetchone()
+                SUM(total_amount) FILTER (WHERE payment_status = 'paid') as total_revenue,
+                SUM(total_amount) FILTER (WHERE payment_status IN ('unpaid', 'partial')) as pending_revenue,
+                SUM(total_amount) FILTER (
+                    WHERE payment_status = 'paid'
+                      AND day >= date_trunc('month', CURRENT_DATE)::date
+                      AND day <  (date_trunc('month', CURRENT_DATE) + interval '1 month')::date
+                ) as this_month_revenue
+            FROM public.revenue_daily
+        """)
+        stats = await cur.fetchone()
     
     return {
         "total_revenue": float(stats["total_revenue"] or 0),
         "pending_revenue": float(stats["pending_revenue"] or 0),
         "this_month_revenue": float(stats["this_month_revenue"] or 0)
-    }
\ No newline at end of file
+    }
+# ----------------- utilization -----------------
+# Reservations overlapping the window [from, to) are clipped to it in SQL,
+# so each one is read once and only per-car (or per-day) totals come back.
+# Rented days and revenue count Active/Completed rentals; revenue is the
+# invoice total prorated by the share of the rental inside the window.
+# Results are cached per (from, to, group_by) for UTILIZATION_CACHE_SEC.
+UTILIZATION_CACHE_SEC = float(os.getenv("UTILIZATION_CACHE_SEC", "60"))
+UTILIZATION_MAX_DAYS = int(os.getenv("UTILIZATION_MAX_DAYS", "3660"))
+_UTILIZATION_CACHE_MAX = 256
+
+_util_cache: dict = {}     # (from, to, group_by) -> (at, value)
+_util_inflight: dict = {}  # (from, to, group_by) -> task
+
+_WINDOW_RESERVATIONS = """
+    WITH r AS (
+      SELECT r.car_id,
+             r.status,
+             LEAST(r.end_date, %(to)s) - GREATEST(r.start_date, %(from)s) AS days,
+             COALESCE(i.total_amount, 0)
+               * (LEAST(r.end_date, %(to)s) - GREATEST(r.start_date, %(from)s))
+               / GREATEST(r.end_date - r.start_date, 1) AS revenue,
+             COALESCE(i.total_amount, 0) / GREATEST(r.end_date - r.start_date, 1) AS daily_revenue,
+             GREATEST(r.start_date, %(from)s) AS clip_start,
+             LEAST(r.end_date, %(to)s)        AS clip_end
+      FROM public.reservations r
+      LEFT JOIN public.invoices i ON i.reservation_id = r.res_id
+      WHERE r.status IN ('Reserved', 'Active', 'Completed')
+        AND r.start_date < %(to)s
+        AND r.end_date   > %(from)s
+    )
+"""
+
+_UTILIZATION_BY_CAR_SQL = _WINDOW_RESERVATIONS + """
+    SELECT c.car_id, c.brand, c.model,
+           c.category::text AS category,
+           COALESCE(SUM(r.days) FILTER (WHERE r.status <> 'Reserved'), 0) AS rented_days,
+           COALESCE(SUM(r.days), 0)                                        AS booked_days,
+           COALESCE(SUM(r.revenue) FILTER (WHERE r.status <> 'Reserved'), 0)::float AS revenue
+    FROM public.cars c
+    LEFT JOIN r ON r.car_id = c.car_id
+    GROUP BY c.car_id
+    ORDER BY c.car_id
+"""
+
+# +1 car / +daily rate on the first rented day, -1 / -rate the day after the
+# last; a running sum over the calendar gives cars on rent and revenue per day
+_UTILIZATION_BY_DAY_SQL = _WINDOW_RESERVATIONS + """
+    , ev AS (
+      SELECT d, SUM(n) AS n, SUM(rate) AS rate
+      FROM (
+        SELECT clip_start AS d, 1 AS n, daily_revenue AS rate FROM r WHERE status <> 'Reserved'
+        UNION ALL
+        SELECT clip_end, -1, -daily_revenue FROM r WHERE status <> 'Reserved'
+      ) x
+      GROUP BY d
+    )
+    SELECT g.day::date AS day,
+           SUM(COALESCE(ev.n, 0))    OVER w AS cars_rented,
+           (SUM(COALESCE(ev.rate, 0)) OVER w)::float AS revenue,
+           (SELECT COUNT(*) FROM public.cars) AS fleet_size
+    FROM generate_series(%(from)s::date, %(to)s::date - 1, interval '1 day') AS g(day)
+    LEFT JOIN ev ON ev.d = g.day::date
+    WINDOW w AS (ORDER BY g.day)
+    ORDER BY g.day
+"""
+
+def _ratio(num: float, den: float) -> float:
+    return round(num / den, 4) if den else 0.0
+
+async def _query_utilization(start: date, end: date, group_by: str) -> dict:
+    days = (end - start).days
+    params = {"from": start, "to": end}
+    async with get_conn() as conn:
+        if group_by == "day":
+            cur = await conn.execute(_UTILIZATION_BY_DAY_SQL, params)
+        else:
+            cur = await conn.execute(_UTILIZATION_BY_CAR_SQL, params)
+        rows = await cur.fetchall()
+
+    if group_by == "day":
+        fleet = rows[0]["fleet_size"] if rows else 0
+        items = [{
+            "day": r["day"],
+            "cars_rented": int(r["cars_rented"]),
+            "utilization": _ratio(int(r["cars_rented"]), fleet),
+            "revenue": round(r["revenue"], 2),
+        } for r in rows]
+        rented = sum(i["cars_rented"] for i in items)
+        revenue = sum(r["revenue"] for r in rows)
+    else:
+        fleet = len(rows)
+        rented = sum(int(r["rented_days"]) for r in rows)
+        revenue = sum(r["revenue"] for r in rows)
+        if group_by == "car":
+            items = [{
+                "car_id": r["car_id"],
+                "brand": r["brand"],
+                "model": r["model"],
+                "category": r["category"],
+                "rented_days": int(r["rented_days"]),
+                "booked_days": int(r["booked_days"]),
+                "utilization": _ratio(int(r["rented_days"]), days),
+                "revenue": round(r["revenue"], 2),
+            } for r in rows]
+        else:
+            by_cat = {}
+            for r in rows:
+                c = by_cat.setdefault(r["category"], {"category": r["category"], "cars": 0, "rented_days": 0,
+                                                       "booked_days": 0, "revenue": 0.0})
+                c["cars"] += 1
+                c["rented_days"] += int(r["rented_days"])
+                c["booked_days"] += int(r["booked_days"])
+                c["revenue"] += r["revenue"]
+            items = []
+            for c in sorted(by_cat.values(), key=lambda c: c["category"]):
+                c["utilization"] = _ratio(c["rented_days"], c["cars"] * days)
+                c["revenue_per_car"] = round(c["revenue"] / c["cars"], 2)
+                c["revenue"] = round(c["revenue"], 2)
+                items.append(c)
+
+    return {
+        "from": start,
+        "to": end,
+        "days": days,
+        "group_by": group_by,
+        "fleet_size": fleet,
+        "totals": {
+            "rented_days": rented,
+            "available_days": fleet * days,
+            "utilization": _ratio(rented, fleet * days),
+            "revenue": round(revenue, 2),
+        },
+        "items": items,
+    }
+
+@router.get("/utilization")
+async def get_utilization(
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+    group_by: Literal["car", "category", "day"] = "car",
+):
+    """
+    Fleet utilization (rented days / available days) and revenue over the
+    window [from, to), per car, per category or per day.
+    Defaults to the 30 days before today.
+    """
+    end = end or date.today()
+    start = start or end - timedelta(days=30)
+    if end <= start:
+        raise HTTPException(status_code=400, detail="'to' must be after 'from'")
+    if (end - start).days > UTILIZATION_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Window is limited to {UTILIZATION_MAX_DAYS} days")
+
+    key = (start, end, group_by)
+    hit = _util_cache.get(key)
+    if hit is not None and time.monotonic() - hit[0] < UTILIZATION_CACHE_SEC:
+        return hit[1]
+
+    # single-flight per window, as for the KPIs
+    task = _util_inflight.get(key)
+    if task is None:
+        task = _util_inflight[key] = asyncio.ensure_future(_query_utilization(start, end, group_by))
+        task.add_done_callback(lambda t: _util_inflight.pop(key, None) if _util_inflight.get(key) is t else None)
+    value = await asyncio.shield(task)
+
+    if len(_util_cache) >= _UTILIZATION_CACHE_MAX:
+        _util_cache.pop(next(iter(_util_cache)))
+    _util_cache[key] = (time.monotonic(), value)
+    return value
+
+# ----------------- live feed -----------------
+# One listener per worker (events.py) feeds every open stream. KPI events
+# are coalesced per wake-up and answered from the shared KPI cache, so N
+# staff screens cost one KPI query per change, not N polls.
+EVENTS_HEARTBEAT_SEC = float(os.getenv("EVENTS_HEARTBEAT_SEC", "15"))
+EVENTS_RETRY_MS = int(os.getenv("EVENTS_RETRY_MS", "3000"))
+
+def _sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data) + b"\n\n"
+
+async def _event_stream():
+    sub = events.subscribe()
+    try:
+        # EventSource reconnects after this delay if the connection drops
+        yield f"retry: {EVENTS_RETRY_MS}\n\n".encode()
+        yield _sse("kpis", await get_kpis())
+        while True:
+            try:
+                first = await asyncio.wait_for(sub.get(), EVENTS_HEARTBEAT_SEC)
+            except asyncio.TimeoutError:
+                yield b": ping\n\n"  # keeps proxies from closing an idle stream
+                continue
+            refresh = False
+            for event in [first] + sub.drain():
+                if event["type"] == "car":
+                    yield _sse("car", {k: v for k, v in event.items() if k != "type"})
+                elif event["type"] == "resync":
+                    yield _sse("resync", {})
+                    refresh = True
+                elif event["type"] == "kpis":
+                    refresh = True
+            if refresh:
+                yield _sse("kpis", await get_kpis())
+    finally:
+        events.unsubscribe(sub)
+
+@router.post("/stream-ticket")
+async def create_stream_ticket(principal: Principal = Depends(get_principal)):
+    """Ticket for GET /dashboard/stream?ticket=..., valid for STREAM_TICKET_SEC."""
+    return {"ticket": make_stream_ticket(principal), "expires_in": STREAM_TICKET_SEC}
+
+@stream_router.get("/stream")
+async def stream_dashboard():
+    """
+    Server-sent events for the staff dashboard:
+    - kpis:   full KPI object (same as /dashboard/kpis), on connect and after changes
+    - car:    {car_id, status, ...changed fields} when a car changes
+    - resync: events may have been missed; reload cars
+    """
+    return StreamingResponse(_event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,33 +1,123 @@
-from fastapi import APIRouter
+import base64
+import json
+from datetime import date, datetime, timedelta
+from typing import Literal
+from fastapi import APIRouter, HTTPException, Depends
 from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from db import get_conn
+from exports import ExportFormat, export_response
+from routers.auth import require_role, STAFF_ROLES
 
-router = APIRouter(prefix="/invoices", tags=["invoices"])
+# values of the payment_status enum; anything else is a 422, not a cast error
+PaymentStatus = Literal["unpaid", "partial", "paid", "void"]
+
+router = APIRouter(prefix="/invoices", tags=["invoices"],
+                   dependencies=[Depends(require_role(*STAFF_ROLES))])
+
+# ----------------- cursor helpers -----------------
+def _encode_cursor(created_at: datetime, inv_id: str) -> str:
+    raw = json.dumps([created_at.isoformat(), inv_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, inv_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), str(inv_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+INVOICE_SELECT = """
+    SELECT
+      i.inv_id,
+      i.reservation_id,
+      i.issue_date,
+      i.total_amount,
+      i.payment_status,
+      i.amount_paid,
+      i.created_at,
+      -- helpful join fields
+      r.customer_license_no,
+      r.car_id,
+      r.start_date,
+      r.end_date
+    FROM public.invoices i
+    JOIN public.reservations r
+      ON r.res_id = i.reservation_id
+    WHERE 1=1
+"""
+
+def _invoice_filters(payment_status, date_from, date_to, customer_license_no, car_id) -> tuple:
+    where, params = [], {}
+    if payment_status:
+        where.append("AND i.payment_status = %(ps)s::payment_status")
+        params["ps"] = payment_status
+    if date_from:
+        where.append("AND i.created_at >= %(dfrom)s")
+        params["dfrom"] = date_from
+    if date_to:
+        where.append("AND i.created_at < %(dto)s")
+        params["dto"] = date_to + timedelta(days=1)
+    if customer_license_no:
+        where.append("AND r.customer_license_no = %(cust)s")
+        params["cust"] = customer_license_no
+    if car_id:
+        where.append("AND r.car_id = %(car)s")
+        params["car"] = car_id
+    return where, params
+
+@router.get("/export")
+async def export_invoices(
+    format: ExportFormat = "csv",
+    payment_status: PaymentStatus | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    customer_license_no: str | None = None,
+    car_id: str | None = None,
+):
+    """Full invoice history (same columns/filters as GET /invoices) streamed as CSV or NDJSON."""
+    where, params = _invoice_filters(payment_status, date_from, date_to, customer_license_no, car_id)
+    sql = INVOICE_SELECT + " ".join(where) + " ORDER BY i.created_at, i.inv_id"
+    return export_response(sql, params, format, "invoices")
 
 @router.get("")
-def list_invoices(limit: int = 100):
+async def list_invoices(
+    limit: int = 100,
+    cursor: str | None = None,
+    payment_status: PaymentStatus | None = None,
+    date_from: date | None = None,
+    date_to: date | None = None,
+    customer_license_no: str | None = None,
+    car_id: str | None = None,
+):
+    """
+    Newest first, keyset-paginated on (created_at, inv_id).
+    Pass the returned next_cursor back as ?cursor= to get the next page;
+    it is null on the last page. date_from/date_to are inclusive days.
+    """
     lim = max(1, min(limit, 200))
-    with get_conn() as conn:
-        rows = conn.execute("""
-            SELECT
-              i.inv_id,
-              i.reservation_id,
-              i.issue_date,
-              i.total_amount,
-              i.payment_status,
-              i.created_at,
-              -- helpful join fields
-              r.customer_license_no,
-              r.car_id,
-              r.start_date,
-              r.end_date
-            FROM public.invoices i
-            JOIN public.reservations r
-              ON r.res_id = i.reservation_id
-            ORDER BY i.created_at DESC
-            LIMIT %(lim)s
-        """, {"lim": lim}).fetchall()
+    where, params = _invoice_filters(payment_status, date_from, date_to, customer_license_no, car_id)
+    params["lim"] = lim + 1
+
+    if cursor:
+        where.append("AND (i.created_at, i.inv_id) < (%(c_at)s, %(c_id)s)")
+        params["c_at"], params["c_id"] = _decode_cursor(cursor)
+
+    sql = INVOICE_SELECT + " ".join(where) + """
+        ORDER BY i.created_at DESC, i.inv_id DESC
+        LIMIT %(lim)s
+    """
+
+    async with get_conn() as conn:
+        cur = await conn.execute(sql, params)
+        rows = await cur.fetchall()
+
+    next_cursor = None
+    if len(rows) > lim:
+        rows = rows[:lim]
+        last = rows[-1]
+        next_cursor = _encode_cursor(last["created_at"], last["inv_id"])
 
     # Safely convert Decimal/Date → JSON
-    return JSONResponse(content=jsonable_encoder(rows))
+    return JSONResponse(content=jsonable_encoder({"items": rows, "next_cursor": next_cursor}))
@@ -1,9 +1,22 @@
-from fastapi import APIRouter, HTTPException, Header
-from pydantic import BaseModel, Field
+import csv
+import io
+import os
+from fastapi import APIRouter, HTTPException, Header, Request, Depends
+from pydantic import BaseModel, Field, ValidationError
 from typing import Optional
 from db import get_conn
+from exports import ExportFormat, export_response
+import events
+import revenue
+import idempotency
+from routers.dashboard import invalidate_kpis
+from routers.auth import require_role
 
-router = APIRouter(prefix="/payments", tags=["payments"])
+# payments are admin-only (staff.html only shows the form to admins)
+router = APIRouter(prefix="/payments", tags=["payments"],
+                   dependencies=[Depends(require_role("admin"))])
+
+BULK_PAYMENTS_MAX = int(os.getenv("BULK_PAYMENTS_MAX", "10000"))
 
 class PayIn(BaseModel):
     invoice_id: str = Field(pattern=r"^INV-\d+$")
@@ -12,49 +25,211 @@ class PayIn(BaseModel):
     reference: Optional[str] = None  # Optional transaction reference
 
 @router.post("/pay")
-def record_payment(payload: PayIn, authorization: Optional[str] = Header(None)):
+async def record_payment(payload: PayIn,
+                         idempotency_key: Optional[str] = Header(None)):
     iid = payload.invoice_id
     amt = float(payload.amount)
     method = payload.method
     reference = payload.reference
 
-    with get_conn() as conn:
+    async with get_conn() as conn:
+        # a retry with the same Idempotency-Key gets the original result
+        replay = await idempotency.begin(conn, "payments.pay", idempotency_key, payload)
+        if replay is not None:
+            return replay
+
         # Lock the invoice row to avoid race conditions
-        inv = conn.execute("""
-            SELECT inv_id, total_amount, payment_status
+        cur = await conn.execute("""
+            SELECT inv_id, issue_date, total_amount, payment_status
             FROM public.invoices
             WHERE inv_id = %(iid)s
             FOR UPDATE
-        """, {"iid": iid}).fetchone()
+        """, {"iid": iid})
+        inv = await cur.fetchone()
 
         if not inv:
             raise HTTPException(status_code=404, detail="Invoice not found")
 
         # Insert payment
-        conn.execute("""
+        await conn.execute("""
             INSERT INTO public.payments (invoice_id, method, amount, reference)
             VALUES (%(iid)s, %(m)s, %(a)s, %(ref)s)
         """, {"iid": iid, "m": method, "a": amt, "ref": reference})
 
-        # Recalculate total paid
-        paid = conn.execute("""
-            SELECT COALESCE(SUM(amount), 0) AS paid
-            FROM public.payments
-            WHERE invoice_id = %(iid)s
-        """, {"iid": iid}).fetchone()["paid"]
-
-        # Decide new status
-        if float(paid) >= float(inv["total_amount"]):
-            new_status = "paid"
-        elif float(paid) > 0:
-            new_status = "partial"
-        else:
-            new_status = "unpaid"
-
-        conn.execute("""
+        # Bump the running paid total and derive the status from it
+        cur = await conn.execute("""
             UPDATE public.invoices
-               SET payment_status = %(s)s::payment_status
+               SET amount_paid = amount_paid + %(a)s,
+                   payment_status = CASE
+                     WHEN payment_status = 'void' THEN 'void'
+                     WHEN amount_paid + %(a)s >= total_amount THEN 'paid'
+                     WHEN amount_paid + %(a)s > 0 THEN 'partial'
+                     ELSE 'unpaid'
+                   END::payment_status
              WHERE inv_id = %(iid)s
-        """, {"s": new_status, "iid": iid})
+            RETURNING issue_date, total_amount, payment_status, amount_paid
+        """, {"a": amt, "iid": iid})
+        new = await cur.fetchone()
+        await revenue.apply_change(conn, inv, new)
+
+        result = {"ok": True, "invoice_id": iid, "status": new["payment_status"], "paid_total": float(new["amount_paid"])}
+        await idempotency.finish(conn, "payments.pay", idempotency_key, result)
+        await events.publish(conn, "kpis")
+
+    invalidate_kpis()
+    return result
+
+
+# ----------------- bulk ingestion -----------------
+async def _read_bulk_lines(request: Request) -> list:
+    """JSON array body, text/csv body, or multipart upload with a 'file' CSV field."""
+    ctype = (request.headers.get("content-type") or "").lower()
+    if ctype.startswith("multipart/form-data"):
+        form = await request.form()
+        upload = form.get("file")
+        if upload is None or isinstance(upload, str):
+            raise HTTPException(status_code=400, detail="Upload a CSV in the 'file' field")
+        raw = await upload.read()
+    elif ctype.startswith("text/csv"):
+        raw = await request.body()
+    else:
+        try:
+            data = await request.json()
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or CSV")
+        if not isinstance(data, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array of payments")
+        return data
+
+    # CSV header: invoice_id,method,amount[,reference]
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="CSV must be UTF-8")
+    return [
+        {k.strip(): ((v or "").strip() or None) for k, v in row.items() if k}
+        for row in csv.DictReader(io.StringIO(text))
+    ]
+
+@router.post("/bulk")
+async def record_payments_bulk(request: Request):
+    """
+    Settlement-file ingestion: every valid line is inserted in one
+    transaction and each touched invoice's status is recomputed once.
+    Returns one result per input line (line numbers start at 1).
+    """
+    lines = await _read_bulk_lines(request)
+    if len(lines) > BULK_PAYMENTS_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_PAYMENTS_MAX} payments per request")
+
+    results = [None] * len(lines)
+    valid = []  # (line index, PayIn)
+    for n, item in enumerate(lines):
+        try:
+            p = PayIn.model_validate(item)
+        except ValidationError as e:
+            err = e.errors()[0]
+            field = ".".join(str(x) for x in err["loc"])
+            results[n] = {"line": n + 1, "ok": False, "error": f"{field}: {err['msg']}" if field else err["msg"]}
+            continue
+        valid.append((n, p))
+
+    touched = {}
+    if valid:
+        ids = sorted({p.invoice_id for _, p in valid})
+        async with get_conn() as conn:
+            # lock in inv_id order so concurrent bulk runs can't deadlock each other
+            cur = await conn.execute("""
+                SELECT inv_id, issue_date, total_amount, payment_status
+                FROM public.invoices
+                WHERE inv_id = ANY(%(ids)s)
+                ORDER BY inv_id
+                FOR UPDATE
+            """, {"ids": ids})
+            locked = {r["inv_id"]: r for r in await cur.fetchall()}
+
+            rows, added = [], {}
+            for n, p in valid:
+                if p.invoice_id not in locked:
+                    results[n] = {"line": n + 1, "ok": False, "error": "Invoice not found"}
+                    continue
+                rows.append((p.invoice_id, p.method, float(p.amount), p.reference))
+                added[p.invoice_id] = added.get(p.invoice_id, 0.0) + float(p.amount)
+
+            if rows:
+                async with conn.cursor() as cur:
+                    async with cur.copy(
+                        "COPY public.payments (invoice_id, method, amount, reference) FROM STDIN"
+                    ) as copy:
+                        for r in rows:
+                            await copy.write_row(r)
+
+                ids = sorted(added)
+                cur = await conn.execute("""
+                    UPDATE public.invoices i
+                       SET amount_paid = i.amount_paid + s.added,
+                           payment_status = CASE
+                             WHEN i.payment_status = 'void' THEN 'void'
+                             WHEN i.amount_paid + s.added >= i.total_amount THEN 'paid'
+                             WHEN i.amount_paid + s.added > 0 THEN 'partial'
+                             ELSE 'unpaid'
+                           END::payment_status
+                      FROM unnest(%(ids)s::text[], %(amts)s::numeric[]) AS s(invoice_id, added)
+                     WHERE i.inv_id = s.invoice_id
+                    RETURNING i.inv_id, i.issue_date, i.total_amount, i.payment_status, i.amount_paid
+                """, {"ids": ids, "amts": [added[i] for i in ids]})
+                touched = {r["inv_id"]: r for r in await cur.fetchall()}
+                await revenue.apply_changes(conn, [(locked[iid], new) for iid, new in touched.items()])
+                await events.publish(conn, "kpis")
+
+    for n, p in valid:
+        if results[n] is None:
+            inv = touched[p.invoice_id]
+            results[n] = {
+                "line": n + 1,
+                "ok": True,
+                "invoice_id": p.invoice_id,
+                "status": inv["payment_status"],
+                "paid_total": float(inv["amount_paid"]),
+            }
+
+    if touched:
+        invalidate_kpis()
+    return {
+        "ok": all(r["ok"] for r in results),
+        "inserted": sum(1 for r in results if r["ok"]),
+        "failed": sum(1 for r in results if not r["ok"]),
+        "results": results,
+    }
+
+
+@router.get("/export")
+async def export_payments(
+    format: ExportFormat = "csv",
+    method: str | None = None,
+    invoice_id: str | None = None,
+):
+    """Full payment history streamed as CSV or NDJSON, with the invoice/reservation it belongs to."""
+    where, params = [], {}
+    if method:
+        where.append("AND p.method = %(m)s")
+        params["m"] = method
+    if invoice_id:
+        where.append("AND p.invoice_id = %(iid)s")
+        params["iid"] = invoice_id
 
-    return {"ok": True, "invoice_id": iid, "status": new_status, "paid_total": float(paid)}
\ No newline at end of file
+    sql = """
+        SELECT
+          p.*,
+          i.reservation_id,
+          i.payment_status AS invoice_status,
+          r.customer_license_no,
+          r.car_id
+        FROM public.payments p
+        JOIN public.invoices i
+          ON i.inv_id = p.invoice_id
+        JOIN public.reservations r
+          ON r.res_id = i.reservation_id
+        WHERE 1=1
+    """ + " ".join(where)
+    return export_response(sql, params, format, "payments")
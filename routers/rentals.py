@@ -1,9 +1,16 @@
-from fastapi import APIRouter, HTTPException
+from typing import Annotated, List
+from fastapi import APIRouter, HTTPException, Depends
 from pydantic import BaseModel, Field
 from db import get_conn
+import catalog
+import events
+import revenue
+from routers.dashboard import invalidate_kpis
+from routers.auth import require_role, STAFF_ROLES
 from datetime import date
 
-router = APIRouter(prefix="/rentals", tags=["rentals"])
+router = APIRouter(prefix="/rentals", tags=["rentals"],
+                   dependencies=[Depends(require_role(*STAFF_ROLES))])
 
 class StartIn(BaseModel):
     reservation_id: str = Field(pattern=r"^RES-\d+$")  # e.g. RES-3
@@ -13,18 +20,33 @@ class CloseIn(BaseModel):
     damage_fee: float = 0
     refuel_fee: float = 0
 
+class StartBatchIn(BaseModel):
+    reservation_ids: List[Annotated[str, Field(pattern=r"^RES-\d+$")]] = Field(min_length=1, max_length=500)
+
+class CloseBatchIn(BaseModel):
+    items: List[CloseIn] = Field(min_length=1, max_length=500)
+
+
+def _rental_total(row: dict, dmg: float, ref: float) -> float:
+    start_d: date = row["start_date"]
+    end_d: date   = row["end_date"]
+    days = max((end_d - start_d).days, 1)
+    base = float(row["price_per_day"] or 0) * days
+    return base + dmg + ref
+
 
 @router.post("/start")
-def start_rental(payload: StartIn):
+async def start_rental(payload: StartIn):
     rid = payload.reservation_id
-    with get_conn() as conn:
-        row = conn.execute("""
+    async with get_conn() as conn:
+        cur = await conn.execute("""
             SELECT r.res_id, r.status, r.car_id, c.status AS car_status
             FROM public.reservations r
             JOIN public.cars c ON c.car_id = r.car_id
             WHERE r.res_id = %(rid)s
             FOR UPDATE
-        """, {"rid": rid}).fetchone()
+        """, {"rid": rid})
+        row = await cur.fetchone()
 
         if not row:
             raise HTTPException(404, "Reservation not found")
@@ -34,35 +56,44 @@ def start_rental(payload: StartIn):
             raise HTTPException(400, f"Car is not available (status={row['car_status']})")
 
         # flip reservation -> Active, car -> Rented
-        conn.execute("UPDATE public.reservations SET status='Active' WHERE res_id=%(rid)s", {"rid": rid})
-        conn.execute("UPDATE public.cars SET status='Rented' WHERE car_id=%(cid)s", {"cid": row["car_id"]})
+        await conn.execute("UPDATE public.reservations SET status='Active' WHERE res_id=%(rid)s", {"rid": rid})
+        await conn.execute("UPDATE public.cars SET status='Rented' WHERE car_id=%(cid)s", {"cid": row["car_id"]})
 
         # ensure invoice exists for this reservation
-        inv = conn.execute("SELECT inv_id FROM public.invoices WHERE reservation_id=%(rid)s", {"rid": rid}).fetchone()
+        cur = await conn.execute("SELECT inv_id FROM public.invoices WHERE reservation_id=%(rid)s", {"rid": rid})
+        inv = await cur.fetchone()
         if not inv:
-            conn.execute("""
+            cur = await conn.execute("""
                 INSERT INTO public.invoices (reservation_id, issue_date, total_amount, payment_status)
                 VALUES (%(rid)s, CURRENT_DATE, 0, 'unpaid')
+                RETURNING issue_date, total_amount, payment_status
             """, {"rid": rid})
+            await revenue.apply_change(conn, None, await cur.fetchone())
+
+        await events.publish(conn, "car", car_id=row["car_id"], status="Rented")
+        await events.publish(conn, "kpis")
 
+    catalog.set_status(row["car_id"], "Rented")
+    invalidate_kpis()
     return {"ok": True, "message": "Rental started"}
 
 
 @router.post("/close")
-def close_rental(payload: CloseIn):
+async def close_rental(payload: CloseIn):
     rid = payload.reservation_id
     dmg = float(payload.damage_fee or 0)
     ref = float(payload.refuel_fee or 0)
 
-    with get_conn() as conn:
-        row = conn.execute("""
+    async with get_conn() as conn:
+        cur = await conn.execute("""
             SELECT r.res_id, r.status, r.car_id, r.start_date, r.end_date,
                    c.status AS car_status, c.price_per_day
             FROM public.reservations r
             JOIN public.cars c ON c.car_id = r.car_id
             WHERE r.res_id = %(rid)s
             FOR UPDATE
-        """, {"rid": rid}).fetchone()
+        """, {"rid": rid})
+        row = await cur.fetchone()
 
         if not row:
             raise HTTPException(404, "Reservation not found")
@@ -70,33 +101,212 @@ def close_rental(payload: CloseIn):
             raise HTTPException(400, "Reservation is not in 'Active' state")
 
         # compute total
-        start_d: date = row["start_date"]
-        end_d: date   = row["end_date"]
-        days = max((end_d - start_d).days, 1)
-        base = float(row["price_per_day"] or 0) * days
-        total = base + dmg + ref
+        total = _rental_total(row, dmg, ref)
 
         # flip reservation -> Completed, car -> Available
-        conn.execute("UPDATE public.reservations SET status='Completed' WHERE res_id=%(rid)s", {"rid": rid})
-        conn.execute("UPDATE public.cars SET status='Available' WHERE car_id=%(cid)s", {"cid": row["car_id"]})
+        await conn.execute("UPDATE public.reservations SET status='Completed' WHERE res_id=%(rid)s", {"rid": rid})
+        await conn.execute("UPDATE public.cars SET status='Available' WHERE car_id=%(cid)s", {"cid": row["car_id"]})
 
-        # update/create invoice
-        inv = conn.execute("SELECT inv_id FROM public.invoices WHERE reservation_id=%(rid)s", {"rid": rid}).fetchone()
+        # update/create invoice; lock it so a concurrent payment can't change
+        # the status between this read and the UPDATE (the rollup delta uses it)
+        cur = await conn.execute("""
+            SELECT inv_id, issue_date, total_amount, payment_status
+            FROM public.invoices
+            WHERE reservation_id=%(rid)s
+            FOR UPDATE
+        """, {"rid": rid})
+        inv = await cur.fetchone()
         if inv:
-            conn.execute("""
+            cur = await conn.execute("""
               UPDATE public.invoices
                  SET total_amount = %(t)s,
                      payment_status = CASE
-                       WHEN %(t)s <= COALESCE((SELECT SUM(amount) FROM public.payments WHERE invoice_id = %(iid)s), 0)
-                         THEN 'paid'::payment_status
+                       WHEN amount_paid >= %(t)s THEN 'paid'::payment_status
+                       WHEN amount_paid > 0 THEN 'partial'::payment_status
                        ELSE 'unpaid'::payment_status
                      END
                WHERE inv_id = %(iid)s
+              RETURNING issue_date, total_amount, payment_status
             """, {"t": total, "iid": inv["inv_id"]})
+            await revenue.apply_change(conn, inv, await cur.fetchone())
         else:
-            conn.execute("""
+            cur = await conn.execute("""
               INSERT INTO public.invoices (reservation_id, issue_date, total_amount, payment_status)
               VALUES (%(rid)s, CURRENT_DATE, %(t)s, 'unpaid')
+              RETURNING issue_date, total_amount, payment_status
             """, {"rid": rid, "t": total})
+            await revenue.apply_change(conn, None, await cur.fetchone())
+
+        await events.publish(conn, "car", car_id=row["car_id"], status="Available")
+        await events.publish(conn, "kpis")
 
+    catalog.set_status(row["car_id"], "Available")
+    invalidate_kpis()
     return {"ok": True, "message": "Rental closed", "total": total}
+
+
+# ----------------- batch check-in / check-out -----------------
+# Same rules as /start and /close, applied to many reservations in one
+# transaction with a fixed number of statements. Items that fail a check
+# are reported and skipped; the rest still go through.
+
+@router.post("/start_batch")
+async def start_rentals_batch(payload: StartBatchIn):
+    seen = set()
+    for rid in payload.reservation_ids:
+        if rid in seen:
+            raise HTTPException(400, f"Duplicate reservation_id {rid}")
+        seen.add(rid)
+    ids = sorted(seen)
+    results = {}
+
+    async with get_conn() as conn:
+        # lock in res_id order so concurrent batches can't deadlock
+        cur = await conn.execute("""
+            SELECT r.res_id, r.status, r.car_id, c.status AS car_status
+            FROM public.reservations r
+            JOIN public.cars c ON c.car_id = r.car_id
+            WHERE r.res_id = ANY(%(ids)s)
+            ORDER BY r.res_id
+            FOR UPDATE
+        """, {"ids": ids})
+        rows = {r["res_id"]: r for r in await cur.fetchall()}
+
+        ok, cars = [], {}
+        for rid in ids:
+            row = rows.get(rid)
+            if not row:
+                results[rid] = {"ok": False, "error": "Reservation not found"}
+            elif row["status"] != "Reserved":
+                results[rid] = {"ok": False, "error": "Reservation is not in 'Reserved' state"}
+            elif row["car_status"] not in ("Available","Reserved") or row["car_id"] in cars:
+                status = "Rented" if row["car_id"] in cars else row["car_status"]
+                results[rid] = {"ok": False, "error": f"Car is not available (status={status})"}
+            else:
+                ok.append(rid)
+                cars[row["car_id"]] = rid
+                results[rid] = {"ok": True}
+
+        if ok:
+            # flip reservations -> Active, cars -> Rented
+            await conn.execute("UPDATE public.reservations SET status='Active' WHERE res_id = ANY(%(ids)s)", {"ids": ok})
+            await conn.execute("UPDATE public.cars SET status='Rented' WHERE car_id = ANY(%(cids)s)", {"cids": list(cars)})
+
+            # ensure an invoice exists for each reservation
+            cur = await conn.execute("""
+                INSERT INTO public.invoices (reservation_id, issue_date, total_amount, payment_status)
+                SELECT rid, CURRENT_DATE, 0, 'unpaid'
+                FROM unnest(%(ids)s::text[]) AS rid
+                WHERE NOT EXISTS (SELECT 1 FROM public.invoices i WHERE i.reservation_id = rid)
+                RETURNING issue_date, total_amount, payment_status
+            """, {"ids": ok})
+            await revenue.apply_changes(conn, [(None, inv) for inv in await cur.fetchall()])
+
+            await events.publish_many(conn, "car", [{"car_id": cid, "status": "Rented"} for cid in cars])
+            await events.publish(conn, "kpis")
+
+    for cid in cars:
+        catalog.set_status(cid, "Rented")
+    if cars:
+        invalidate_kpis()
+
+    return {
+        "ok": all(r["ok"] for r in results.values()),
+        "started": len(cars),
+        "results": [{"reservation_id": rid, **results[rid]} for rid in payload.reservation_ids],
+    }
+
+
+@router.post("/close_batch")
+async def close_rentals_batch(payload: CloseBatchIn):
+    items = {}
+    for it in payload.items:
+        if it.reservation_id in items:
+            raise HTTPException(400, f"Duplicate reservation_id {it.reservation_id}")
+        items[it.reservation_id] = it
+    ids = sorted(items)
+    results = {}
+
+    async with get_conn() as conn:
+        # lock reservations/cars, then their invoices, always in id order
+        cur = await conn.execute("""
+            SELECT r.res_id, r.status, r.car_id, r.start_date, r.end_date,
+                   c.status AS car_status, c.price_per_day
+            FROM public.reservations r
+            JOIN public.cars c ON c.car_id = r.car_id
+            WHERE r.res_id = ANY(%(ids)s)
+            ORDER BY r.res_id
+            FOR UPDATE
+        """, {"ids": ids})
+        rows = {r["res_id"]: r for r in await cur.fetchall()}
+
+        totals, cars = {}, []
+        for rid in ids:
+            row = rows.get(rid)
+            if not row:
+                results[rid] = {"ok": False, "error": "Reservation not found"}
+            elif row["status"] != "Active":
+                results[rid] = {"ok": False, "error": "Reservation is not in 'Active' state"}
+            else:
+                it = items[rid]
+                totals[rid] = _rental_total(row, float(it.damage_fee or 0), float(it.refuel_fee or 0))
+                cars.append(row["car_id"])
+                results[rid] = {"ok": True, "total": totals[rid]}
+
+        if totals:
+            ok = sorted(totals)
+            cur = await conn.execute("""
+                SELECT inv_id, reservation_id, issue_date, total_amount, payment_status
+                FROM public.invoices
+                WHERE reservation_id = ANY(%(ids)s)
+                ORDER BY inv_id
+                FOR UPDATE
+            """, {"ids": ok})
+            old = {r["reservation_id"]: r for r in await cur.fetchall()}
+
+            # flip reservations -> Completed, cars -> Available
+            await conn.execute("UPDATE public.reservations SET status='Completed' WHERE res_id = ANY(%(ids)s)", {"ids": ok})
+            await conn.execute("UPDATE public.cars SET status='Available' WHERE car_id = ANY(%(cids)s)", {"cids": cars})
+
+            changes = []
+            upd = [rid for rid in ok if rid in old]
+            if upd:
+                cur = await conn.execute("""
+                  UPDATE public.invoices i
+                     SET total_amount = s.total,
+                         payment_status = CASE
+                           WHEN i.amount_paid >= s.total THEN 'paid'::payment_status
+                           WHEN i.amount_paid > 0 THEN 'partial'::payment_status
+                           ELSE 'unpaid'::payment_status
+                         END
+                    FROM unnest(%(ids)s::text[], %(totals)s::numeric[]) AS s(rid, total)
+                   WHERE i.reservation_id = s.rid
+                  RETURNING i.reservation_id, i.issue_date, i.total_amount, i.payment_status
+                """, {"ids": upd, "totals": [totals[rid] for rid in upd]})
+                changes += [(old[r["reservation_id"]], r) for r in await cur.fetchall()]
+
+            new = [rid for rid in ok if rid not in old]
+            if new:
+                cur = await conn.execute("""
+                  INSERT INTO public.invoices (reservation_id, issue_date, total_amount, payment_status)
+                  SELECT rid, CURRENT_DATE, total, 'unpaid'
+                  FROM unnest(%(ids)s::text[], %(totals)s::numeric[]) AS s(rid, total)
+                  RETURNING issue_date, total_amount, payment_status
+                """, {"ids": new, "totals": [totals[rid] for rid in new]})
+                changes += [(None, r) for r in await cur.fetchall()]
+
+            await revenue.apply_changes(conn, changes)
+
+            await events.publish_many(conn, "car", [{"car_id": cid, "status": "Available"} for cid in cars])
+            await events.publish(conn, "kpis")
+
+    for cid in cars:
+        catalog.set_status(cid, "Available")
+    if cars:
+        invalidate_kpis()
+
+    return {
+        "ok": all(r["ok"] for r in results.values()),
+        "closed": len(cars),
+        "results": [{"reservation_id": it.reservation_id, **results[it.reservation_id]} for it in payload.items],
+    }
@@ -1,9 +1,14 @@
 from datetime import date
 from typing import Optional
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Depends
 from pydantic import BaseModel, field_validator
+from psycopg import errors
 from db import get_conn
-from routers.auth import verify_token  # your updated auth should put license_no in sub
+import events
+import revenue
+import idempotency
+from routers.dashboard import invalidate_kpis
+from routers.auth import Principal, get_customer
 
 router = APIRouter(prefix="/reservations", tags=["reservations"])
 
@@ -28,62 +33,65 @@ class ReserveAuthedIn(BaseModel):
         return v
 
 
-def _calc_total(conn, car_id: str, start: date, end: date) -> float:
-    days = (end - start).days
+@router.post("/create_auth")
+async def create_reservation_authed(payload: ReserveAuthedIn,
+                                    customer: Principal = Depends(get_customer),
+                                    idempotency_key: Optional[str] = Header(None)):
+    # 1) who is the customer?  (resolved from the bearer token by get_customer)
+    license_no = customer.sub
+
+    # 2) create reservation + invoice in one statement; the
+    #    reservations_no_overlap exclusion constraint (migrations/0001)
+    #    rejects clashes atomically, even for concurrent bookings
+    days = (payload.end_date - payload.start_date).days
     if days < 1:
         raise HTTPException(status_code=400, detail="Minimum rental is 1 day")
-    car = conn.execute(
-        "SELECT price_per_day FROM public.cars WHERE car_id=%(id)s",
-        {"id": car_id}
-    ).fetchone()
-    if not car:
-        raise HTTPException(status_code=404, detail="Car not found")
-    return days * float(car["price_per_day"])
-
 
-@router.post("/create_auth")
-def create_reservation_authed(payload: ReserveAuthedIn,
-                              authorization: Optional[str] = Header(None)):
-    # 1) who is the customer?  (JWT sub should be license_no now)
-    claims = verify_token(authorization)
-    if not claims:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    license_no = claims["sub"]
+    scope = f"reservations.create:{license_no}"
+    async with get_conn() as conn:
+        # a retry with the same Idempotency-Key gets the original result
+        replay = await idempotency.begin(conn, scope, idempotency_key, payload)
+        if replay is not None:
+            return replay
 
-    # 2) Check availability & create reservation + invoice
-    with get_conn() as conn:
-        # overlap check on active/reserved
-        clash = conn.execute("""
-            SELECT 1
-            FROM public.reservations
-            WHERE car_id = %(car)s
-              AND status IN ('Reserved','Active')
-              AND NOT (%(end)s <= start_date OR %(start)s >= end_date)
-            LIMIT 1
-        """, {"car": payload.car_id, "start": payload.start_date, "end": payload.end_date}).fetchone()
-        if clash:
+        try:
+            cur = await conn.execute("""
+                WITH car AS (
+                  SELECT price_per_day
+                  FROM public.cars
+                  WHERE car_id = %(car)s
+                ), res AS (
+                  INSERT INTO public.reservations (
+                    customer_license_no, car_id, start_date, end_date, status
+                  )
+                  SELECT %(cust)s, %(car)s, %(start)s, %(end)s, 'Reserved'
+                  FROM car
+                  RETURNING res_id
+                ), inv AS (
+                  INSERT INTO public.invoices (reservation_id, total_amount, payment_status)
+                  SELECT res.res_id, %(days)s * car.price_per_day, 'unpaid'
+                  FROM res, car
+                  RETURNING inv_id, issue_date, total_amount, payment_status
+                )
+                SELECT res.res_id, inv.inv_id, inv.issue_date, inv.total_amount, inv.payment_status
+                FROM res, inv
+            """, {
+                "cust": license_no,
+                "car": payload.car_id,
+                "start": payload.start_date,
+                "end": payload.end_date,
+                "days": days,
+            })
+        except errors.ExclusionViolation:
             raise HTTPException(status_code=409, detail="Car not available for selected dates")
+        row = await cur.fetchone()
+        if not row:
+            raise HTTPException(status_code=404, detail="Car not found")
 
-        total = _calc_total(conn, payload.car_id, payload.start_date, payload.end_date)
-
-        res = conn.execute("""
-            INSERT INTO public.reservations (
-              customer_license_no, car_id, start_date, end_date, status
-            ) VALUES (
-              %(cust)s, %(car)s, %(start)s, %(end)s, 'Reserved'
-            )
-            RETURNING res_id
-        """, {
-            "cust": license_no,
-            "car": payload.car_id,
-            "start": payload.start_date,
-            "end": payload.end_date
-        }).fetchone()
-
-        inv = conn.execute("""
-            INSERT INTO public.invoices (reservation_id, total_amount, payment_status)
-            VALUES (%(rid)s, %(total)s, 'unpaid')
-            RETURNING inv_id, total_amount
-        """, {"rid": res["res_id"], "total": total}).fetchone()
+        await revenue.apply_change(conn, None, row)
+        result = {"reservation_id": row["res_id"], "invoice_id": row["inv_id"], "total_amount": float(row["total_amount"])}
+        await idempotency.finish(conn, scope, idempotency_key, result)
+        await events.publish(conn, "kpis")
 
-    return {"reservation_id": res["res_id"], "invoice_id": inv["inv_id"], "total_amount": float(inv["total_amount"])}
+    invalidate_kpis()  # may be a pickup today
+    return result
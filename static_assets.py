@@ -0,0 +1,131 @@
+# static_assets.py
+"""
+In-memory static pages/assets (index.html, styles.css, config.js, ...).
+
+Each file is read once at startup, compressed once (gzip, plus brotli when
+the optional `brotli` package is installed) and served from memory with a
+content-hash ETag, so repeat visits are answered with 304 and no file I/O.
+Set STATIC_RELOAD=1 in development to pick up edits without a restart.
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+from pathlib import Path
+from typing import Optional
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip only
+    brotli = None
+
+BASE_DIR = Path(__file__).parent
+
+# url path -> file (relative to BASE_DIR)
+ASSETS = {
+    "/": "index.html",
+    "/login.html": "login.html",
+    "/signup.html": "signup.html",
+    "/reset.html": "reset.html",
+    "/staff-login.html": "staff-login.html",
+    "/staff.html": "staff.html",
+    "/config.js": "config.js",
+    "/styles.css": "styles.css",
+    "/staff.css": "staff.css",
+}
+
+# Asset URLs are not fingerprinted, so CSS/JS (including config.js with
+# API_BASE) must revalidate like the HTML, or a deploy would pair new pages
+# with day-old scripts. Revalidation is a cheap 304 via the ETag.
+STATIC_HTML_CACHE_CONTROL = os.getenv("STATIC_HTML_CACHE_CONTROL", "no-cache")
+STATIC_ASSET_CACHE_CONTROL = os.getenv("STATIC_ASSET_CACHE_CONTROL", "no-cache")
+STATIC_RELOAD = os.getenv("STATIC_RELOAD", "0") == "1"
+
+_CONTENT_TYPES = {
+    ".html": "text/html; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".js": "application/javascript; charset=utf-8",
+}
+
+_cache: dict = {}  # url path -> asset dict
+
+def _build(path: Path) -> dict:
+    raw = path.read_bytes()
+    digest = hashlib.sha256(raw).hexdigest()[:16]
+    variants = {"identity": raw, "gzip": gzip.compress(raw, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants["br"] = brotli.compress(raw, quality=11)
+    # only keep encodings that actually save bytes
+    variants = {enc: body for enc, body in variants.items()
+                if enc == "identity" or len(body) < len(raw)}
+    suffix = path.suffix.lower()
+    return {
+        "path": path,
+        "mtime": path.stat().st_mtime,
+        "digest": digest,
+        "variants": variants,
+        "content_type": _CONTENT_TYPES.get(suffix) or mimetypes.guess_type(path.name)[0] or "application/octet-stream",
+        "cache_control": STATIC_HTML_CACHE_CONTROL if suffix == ".html" else STATIC_ASSET_CACHE_CONTROL,
+    }
+
+def load():
+    for url, name in ASSETS.items():
+        _cache[url] = _build(BASE_DIR / name)
+
+def _get(url: str) -> dict:
+    asset = _cache.get(url)
+    if asset is None:
+        asset = _cache[url] = _build(BASE_DIR / ASSETS[url])
+    elif STATIC_RELOAD and asset["path"].stat().st_mtime != asset["mtime"]:
+        asset = _cache[url] = _build(asset["path"])
+    return asset
+
+def _pick_encoding(accept_encoding: Optional[str], available) -> str:
+    accepted = {}
+    for part in (accept_encoding or "").lower().split(","):
+        token, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        if token:
+            accepted[token] = q
+    for enc in ("br", "gzip"):
+        if enc in available and accepted.get(enc, accepted.get("*", 0)) > 0:
+            return enc
+    return "identity"
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if if_none_match.strip() == "*":
+        return True
+    return any(t.strip() in (etag, "W/" + etag) for t in if_none_match.split(","))
+
+def serve(url: str, request: Request) -> Response:
+    asset = _get(url)
+    enc = _pick_encoding(request.headers.get("accept-encoding"), asset["variants"])
+    etag = f'"{asset["digest"]}-{enc}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": asset["cache_control"],
+        "Vary": "Accept-Encoding",
+    }
+    inm = request.headers.get("if-none-match")
+    if inm and _etag_matches(inm, etag):
+        return Response(status_code=304, headers=headers)
+    if enc != "identity":
+        headers["Content-Encoding"] = enc
+    return Response(content=asset["variants"][enc], media_type=asset["content_type"], headers=headers)
+
+def _endpoint(url: str):
+    async def endpoint(request: Request) -> Response:
+        return serve(url, request)
+    return endpoint
+
+def register(app: FastAPI):
+    """Add a GET route for every entry in ASSETS."""
+    for url in ASSETS:
+        app.add_api_route(url, _endpoint(url), methods=["GET"], include_in_schema=False)